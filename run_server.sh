@@ -17,6 +17,9 @@ ollama run llama3 || true
 ollama pull qwen2.5vl:7b
 ollama run qwen2.5vl:7b || true
 
+# Fast first tier for the OCR cascade (only needed when OCR_CASCADE = True in src/config.py)
+# ollama pull qwen2.5vl:3b
+
 
 module load Miniforge3
 module load CUDA/11.8.0
@@ -33,6 +36,12 @@ pip install -r requirements.txt
 pip install -U langchain-community
 
 
+# Download/load the embedding model before the first user arrives
+python -m modules.rag_store warmup
+
+# Finish ingestion jobs left behind if a previous job died mid-batch
+python bulk_ingest.py --resume
+
 # Run the evaluation script
 echo "++++++++++++++++++++++START+++++++++++++++++++++++++++++"
 streamlit run app.py
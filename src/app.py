@@ -1,16 +1,26 @@
 # app.py
 
 import streamlit as st
+import json
 import os
-from modules.ocr_parser import parse_image
-from modules.rag_store import init_vectorstore, add_doc, clear_vectorstore
+from config import OCR_STREAMING, EMBED_WARMUP, SCHED_APP_CONCURRENCY
+from modules.job_queue import get_job_queue
+from modules.rag_store import init_vectorstore, clear_vectorstore, warm_up
 from modules.analytics import (
     build_dataframe_from_vectorstore,
     monthly_summary,
     top_vendors,
     top_items
 )
-from modules.llm_agent import get_combined_agent
+from modules.llm_agent import get_combined_agent, FinalAnswerStreamHandler, answer_query
+from modules.llm_provider import get_response_cache
+from modules.ocr_cache import get_ocr_cache
+from modules.reranker import get_context_stats
+from modules.scheduler import configure_scheduler, get_scheduler, priority_scope, QueueFullError
+from modules.singleflight import get_single_flight
+
+# This process's share of the Ollama concurrency; bulk_ingest.py runs get the rest
+configure_scheduler(max_limit=SCHED_APP_CONCURRENCY)
 
 # UI Config
 st.set_page_config(page_title="Check & Invoice AI", layout="wide")
@@ -33,17 +43,63 @@ with st.sidebar:
         st.success("All documents removed from the vectorstore.")
         st.rerun()  # <- updated API
 
+    ocr_stats = get_ocr_cache().stats()
+    st.caption(
+        f"OCR cache: {ocr_stats['entries']} entries, "
+        f"{ocr_stats['hits']} hits / {ocr_stats['misses']} misses"
+    )
+    if st.button("Clear OCR Cache"):
+        get_ocr_cache().invalidate()
+        st.success("OCR cache cleared.")
+
+    llm_stats = get_response_cache().stats()
+    st.caption(
+        f"LLM cache: {llm_stats['entries']} entries, hit rate {llm_stats['hit_rate']:.0%} "
+        f"({llm_stats['exact_hits']} exact / {llm_stats['semantic_hits']} semantic)"
+    )
+
+    for name in ("ocr", "llm"):
+        flight = get_single_flight(name).stats()
+        st.caption(
+            f"{name.upper()} coalesced: {flight['coalesced']} of {flight['executed'] + flight['coalesced']} "
+            f"requests (max {flight['max_waiters']} waiters on one key)"
+        )
+
+    sched = get_scheduler().stats()
+    if sched:
+        st.caption(
+            f"Model calls: limit {sched['limit']}, {sched['running']} running, "
+            f"{sched['queued']['interactive']} interactive / {sched['queued']['batch']} batch queued; "
+            f"interactive wait p95 {sched['wait_s']['interactive']['p95']:.2f}s"
+        )
+
+    context = get_context_stats().stats()
+    if context["queries"]:
+        st.caption(
+            f"RAG context: {context['tokens_saved']} tokens saved ({context['saved_rate']:.0%}) over "
+            f"{context['queries']} queries, rerank {context['avg_rerank_ms']:.0f} ms avg; "
+            f"answer p50 {context['answer_s']['p50']:.1f}s / p95 {context['answer_s']['p95']:.1f}s"
+        )
+
+
+
 
 
+@st.cache_resource(show_spinner="Loading embedding model...")
+def load_vectorstore():
+    """One vector store and embedding model for all sessions of this server."""
+    if EMBED_WARMUP:
+        print(f"[INFO] Embedding warm-up: {warm_up()}")
+    return init_vectorstore()
 
 
 # Session-based persistent vectorstore
 if "vectorstore" not in st.session_state:
-    st.session_state.vectorstore = init_vectorstore()
+    st.session_state.vectorstore = load_vectorstore()
 
 # Upload Section
-st.header("Upload a Check / Invoice Image")
-uploaded_file = st.file_uploader("Choose an image", type=["jpg", "jpeg", "png"])
+st.header("Upload a Check / Invoice Image or PDF")
+uploaded_file = st.file_uploader("Choose an image or PDF", type=["jpg", "jpeg", "png", "pdf"])
 
 
 if uploaded_file:
@@ -51,9 +107,60 @@ if uploaded_file:
     with open(file_path, "wb") as f:
         f.write(uploaded_file.read())
 
-    parsed = parse_image(file_path)
-    add_doc(st.session_state.vectorstore, parsed)
-    st.success("Document processed and added to database!")
+    # Show header fields as soon as the model emits them
+    live_labels = {"vendor": "Vendor", "invoice_number": "Invoice #", "date": "Date",
+                   "document_type": "Document Type", "total": "Total"}
+    live_slot = st.empty()
+    live_box = live_slot.container()
+    live_fields = {}
+    timing = {}
+
+    def show_field(key, value, elapsed):
+        timing.setdefault("first_field", elapsed)
+        if key in live_labels and value not in ("", None):
+            if key not in live_fields:
+                live_fields[key] = live_box.empty()
+            live_fields[key].markdown(f"**{live_labels[key]}:** {value}")
+
+    # Parse -> store -> log through the durable job queue; a file that was already
+    # ingested (e.g. on a Streamlit rerun) is not parsed or stored again
+    job_queue = get_job_queue()
+    job_id = job_queue.enqueue(file_path)
+    # Processed before the vector store was cleared: store it again from the saved OCR result
+    job_queue.requeue_missing(st.session_state.vectorstore, [job_id])
+    job = job_queue.claim(job_id)
+    if job is not None:
+        with st.spinner("Reading document..."):
+            try:
+                # A user is waiting on this upload: schedule its OCR ahead of bulk ingestion
+                with priority_scope("interactive"):
+                    parsed = job_queue.run_job(job, st.session_state.vectorstore,
+                                               stream=OCR_STREAMING, on_field=show_field)
+            except QueueFullError:
+                parsed = None
+                st.warning("The server is busy right now; upload the document again in a moment.")
+            except Exception as e:
+                parsed = None
+                st.error(f"Processing failed, it will be retried on the next upload: {e}")
+        live_slot.empty()
+        if "first_field" in timing:
+            st.caption(f"First field after {timing['first_field']:.1f}s")
+        if parsed:
+            st.success("Document processed and added to database!")
+
+    stored = job_queue.get(job_id)
+    if job is None:
+        parsed = json.loads(stored["parsed"]) if stored["parsed"] else None
+        if stored["stage"] == "done":
+            st.info("This document was already processed.")
+        elif stored["stage"] != "failed":
+            st.warning(f"This document is being processed by another worker (stage: {stored['stage']}).")
+    if stored["stage"] == "failed":
+        st.error(f"Processing failed after {stored['attempts']} attempts: {stored['error']}")
+        if st.button("Retry processing"):
+            job_queue.retry_failed([job_id])
+            st.rerun()
+    parsed = parsed or {}
 
     st.subheader("Parsed Invoice Preview")
     with st.expander("Metadata"):
@@ -67,6 +174,7 @@ if uploaded_file:
         col3.markdown(f"**Amount:** ${parsed.get('amount', '')}")
         col3.markdown(f"**Tax:** {parsed.get('tax', '')}")
         col3.markdown(f"**Total:** ${parsed.get('total', '')}")
+        col3.markdown(f"**OCR Tier:** {parsed.get('ocr_tier', '')}")
 
         st.markdown(f"**Vendor Address:** {parsed.get('vendor_address', '')}")
         st.markdown(f"**Customer Name:** {parsed.get('customer_name', '')}")
@@ -124,10 +232,15 @@ with st.expander("💡 Try These Questions"):
     """)
 
 if query:
+    answer_slot = st.empty()
+    stream_handler = FinalAnswerStreamHandler(lambda text: answer_slot.markdown(f"**Answer:** {text}▌"))
     with st.spinner("Thinking..."):
         try:
-            response = agent.run(query)
-            st.markdown(f"**Answer:** {response}")
+            response = answer_query(agent, st.session_state.vectorstore, query, callbacks=[stream_handler])
+            answer_slot.markdown(f"**Answer:** {response}")
+        except QueueFullError:
+            answer_slot.empty()
+            st.warning("The model server is busy right now. Please ask again in a moment.")
         except Exception as e:
             st.error(f"Agent failed to answer: {e}")
 
@@ -0,0 +1,431 @@
+# benchmark.py
+# Usage: python benchmark.py <benchmark> [options]   (python benchmark.py -h lists them)
+
+import argparse
+import os
+import time
+from config import OLLAMA_BASE_URL, OCR_PREPROCESS, ADD_DOCS_BATCH_SIZE
+
+DATASET_DIR = os.path.join("..", "notebooks", "dataset")
+SCALAR_FIELDS = [
+    "invoice_number", "check_number", "po_number", "vendor", "vendor_address",
+    "customer_name", "customer_address", "date", "due_date", "payment_date",
+    "amount", "subtotal", "tax", "discount", "total", "currency",
+    "payment_method", "account_number", "routing_number", "bank_name", "document_type",
+]
+
+
+def dataset_images(directory):
+    return [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory))
+        if name.lower().endswith((".jpg", ".jpeg", ".png"))
+    ]
+
+
+def field_agreement(pred, ref):
+    """Share of non-empty reference fields reproduced in `pred` (items compared by count)."""
+    keys = [k for k in SCALAR_FIELDS if str(ref.get(k, "")).strip()]
+    matched = sum(
+        1 for k in keys
+        if str(pred.get(k, "")).strip().lower() == str(ref.get(k, "")).strip().lower()
+    )
+    total = len(keys)
+    if ref.get("items"):
+        total += 1
+        matched += int(len(pred.get("items", [])) == len(ref["items"]))
+    return matched / total if total else 1.0
+
+
+# --- Image preprocessing -----------------------------------------------------
+
+PREPROCESS_PRESETS = {
+    "raw": {"enabled": False},
+    "default": OCR_PREPROCESS,
+    "small": {**OCR_PREPROCESS, "max_edge": 1024, "quality": 75},
+    "gray": {**OCR_PREPROCESS, "grayscale": True, "format": "WEBP", "quality": 70},
+    "binary": {**OCR_PREPROCESS, "binarize": 160, "format": "WEBP", "quality": 70},
+}
+
+
+def bench_preprocess(args):
+    """Payload size, preprocessing time and (unless --offline) OCR latency/agreement per preset."""
+    from modules.ocr_parser import parse_image, preprocess_image
+
+    images = dataset_images(args.dataset)
+    print(f"{'preset':<8} {'image':<24} {'bytes':>9} {'prep_ms':>8} {'ocr_s':>7} {'agree':>6}")
+    for image_path in images:
+        with open(image_path, "rb") as f:
+            original = f.read()
+        reference = None
+        for name, options in PREPROCESS_PRESETS.items():
+            t = time.perf_counter()
+            payload = preprocess_image(original, options, label=name)
+            prep_ms = (time.perf_counter() - t) * 1000
+            ocr_s, agree = "-", "-"
+            if not args.offline:
+                t = time.perf_counter()
+                parsed = parse_image(image_path, base_url=args.base_url, use_cache=False, preprocess=options)
+                ocr_s = f"{time.perf_counter() - t:.2f}"
+                if reference is None:
+                    reference = parsed
+                agree = f"{field_agreement(parsed, reference):.2f}"
+            print(f"{name:<8} {os.path.basename(image_path):<24} {len(payload):>9} "
+                  f"{prep_ms:>8.1f} {ocr_s:>7} {agree:>6}")
+    print("\nAgreement is measured against the 'raw' preset's own output for each image.")
+
+
+# --- Tiled OCR for tall receipts ---------------------------------------------
+
+def make_tall_receipt(path, n_items, width=600, row_height=28):
+    """Render a synthetic long receipt with known line items; returns the item names."""
+    from PIL import Image, ImageDraw
+
+    names = [f"ITEM {i:03d} PRODUCT" for i in range(1, n_items + 1)]
+    height = (n_items + 8) * row_height
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    y = row_height
+    draw.text((20, y), "SUPERMARKET DEMO - Receipt 2024-03-01", fill="black")
+    y += 2 * row_height
+    for i, name in enumerate(names, start=1):
+        draw.text((20, y), f"{name}   1 x {i}.00   {i}.00", fill="black")
+        y += row_height
+    total = n_items * (n_items + 1) / 2
+    draw.text((20, y + row_height), f"TOTAL   {total:.2f}", fill="black")
+    img.save(path)
+    return names
+
+
+def item_recall(pred_items, names):
+    found = {str(i.get("item", "")).upper().strip() for i in pred_items if isinstance(i, dict)}
+    return sum(1 for name in names if name in found) / len(names) if names else 1.0
+
+
+def bench_tiling(args):
+    """Latency and item recall of single-shot parse_image vs. parse_tall_image on tall receipts."""
+    import tempfile
+    from modules.ocr_parser import parse_image, parse_tall_image, split_into_strips
+
+    samples = []
+    tmp = tempfile.mkdtemp()
+    for n in args.items:
+        path = os.path.join(tmp, f"receipt_{n}.png")
+        samples.append((path, make_tall_receipt(path, n)))
+
+    print(f"{'image':<18} {'strips':>6} {'mode':<8} {'ocr_s':>7} {'items':>6} {'recall':>7}")
+    for path, names in samples:
+        with open(path, "rb") as f:
+            strips = len(split_into_strips(f.read()))
+        if args.offline:
+            print(f"{os.path.basename(path):<18} {strips:>6} {'-':<8} {'-':>7} {len(names):>6} {'-':>7}")
+            continue
+        for mode, fn in (("single", parse_image), ("tiled", parse_tall_image)):
+            t = time.perf_counter()
+            parsed = fn(path, base_url=args.base_url, use_cache=False)
+            elapsed = time.perf_counter() - t
+            items = parsed.get("items", [])
+            print(f"{os.path.basename(path):<18} {strips:>6} {mode:<8} {elapsed:>7.2f} "
+                  f"{len(items):>6} {item_recall(items, names):>7.2f}")
+
+
+def bench_load(args):
+    """Throughput and latency percentiles of concurrent OCR and agent calls at several concurrency levels."""
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+    from modules.llm_provider import OllamaLLM
+    from modules.ocr_parser import parse_image_bytes
+    from modules.telemetry import percentile
+
+    if args.offline:
+        print("load: needs Ollama (use --fake to run it without one)")
+        return
+    llm = OllamaLLM(base_url=args.base_url, use_response_cache=False, call_site="bench")
+    images = []
+    for i in range(args.requests):
+        buf = io.BytesIO()
+        Image.new("RGB", (64, 64), (i % 256, (i * 7) % 256, 128)).save(buf, format="PNG")
+        images.append(buf.getvalue())
+
+    def ocr_call(i):
+        t = time.perf_counter()
+        parse_image_bytes(images[i], f"load_{i}", base_url=args.base_url, use_cache=False)
+        return time.perf_counter() - t
+
+    def llm_call(i):
+        t = time.perf_counter()
+        llm.invoke(f"Question {i}: how many invoices are there?")
+        return time.perf_counter() - t
+
+    print(f"{'kind':<6} {'conc':>5} {'reqs':>5} {'wall_s':>7} {'req/s':>7} {'p50_s':>7} {'p95_s':>7}")
+    for kind, fn in (("ocr", ocr_call), ("llm", llm_call)):
+        for concurrency in args.concurrency:
+            t = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                latencies = sorted(pool.map(fn, range(args.requests)))
+            wall = time.perf_counter() - t
+            print(f"{kind:<6} {concurrency:>5} {args.requests:>5} {wall:>7.2f} {args.requests / wall:>7.2f} "
+                  f"{percentile(latencies, 50):>7.3f} {percentile(latencies, 95):>7.3f}")
+
+
+def bench_add_docs(args):
+    """Per-document add_doc loop vs. batched add_docs on synthetic invoices (embedding + Chroma writes)."""
+    import shutil
+    import tempfile
+    from modules.fake_ollama import fake_invoice
+    from modules.rag_store import init_vectorstore, add_doc, add_docs
+
+    print(f"{'docs':>6} {'mode':<10} {'seconds':>8} {'docs/s':>8}")
+    for n in args.docs:
+        for mode in ("add_doc", "add_docs"):
+            # Different invoices per mode, so the second run cannot hit the embedding cache
+            invoices = [fake_invoice(f"bench-{mode}-{n}-{i}") for i in range(n)]
+            tmp = tempfile.mkdtemp()
+            try:
+                vectorstore = init_vectorstore(persist_directory=tmp)
+                t = time.perf_counter()
+                if mode == "add_doc":
+                    for parsed in invoices:
+                        add_doc(vectorstore, parsed)
+                else:
+                    add_docs(vectorstore, invoices, batch_size=args.batch_size)
+                elapsed = time.perf_counter() - t
+                stored = vectorstore.get(include=["metadatas"])["metadatas"]
+                assert sum(1 for meta in stored if meta.get("chunk") != "item") == n
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+            print(f"{n:>6} {mode:<10} {elapsed:>8.2f} {n / elapsed:>8.1f}")
+
+
+def bench_startup(args):
+    """Vector store start-up: fresh model per session (old behaviour) vs. the shared process-wide one."""
+    import tempfile
+    from langchain.embeddings import HuggingFaceEmbeddings
+    from langchain.vectorstores import Chroma
+    from config import EMBED_MODEL
+    from modules import rag_store
+
+    def timed(fn):
+        t = time.perf_counter()
+        result = fn()
+        return time.perf_counter() - t, result
+
+    import_s, _ = timed(lambda: __import__("sentence_transformers"))
+    print(f"import sentence_transformers: {import_s:.2f}s")
+    tmp = tempfile.mkdtemp()
+
+    def fresh_store():
+        embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+        return Chroma(collection_name="checks", embedding_function=embeddings, persist_directory=tmp)
+
+    for session in range(1, args.sessions + 1):
+        seconds, store = timed(fresh_store)
+        query_s, _ = timed(lambda: store.similarity_search("invoice from Acme", k=1))
+        print(f"per-session model  session {session}: init {seconds:6.2f}s  first query {query_s:6.3f}s")
+    print(f"warm-up: {rag_store.warm_up()}")
+    for session in range(1, args.sessions + 1):
+        seconds, store = timed(lambda: rag_store.init_vectorstore(persist_directory=tmp))
+        query_s, _ = timed(lambda: store.similarity_search("invoice from Acme", k=1))
+        print(f"shared model       session {session}: init {seconds:6.2f}s  first query {query_s:6.3f}s")
+
+
+def _embed_backend_run(backend, n, batch_size):
+    """Runs in a fresh process so each backend's peak RSS is measured on its own."""
+    import resource
+    from modules.fake_ollama import fake_invoice
+    from modules.rag_store import build_document, load_embedding_backend
+
+    texts = [build_document(fake_invoice(f"embed-{i}")).page_content for i in range(n)]
+    t = time.perf_counter()
+    embeddings, _ = load_embedding_backend(backend)
+    load_s = time.perf_counter() - t
+    embeddings.embed_documents(texts[:batch_size])  # Warm-up
+    t = time.perf_counter()
+    for start in range(0, n, batch_size):
+        embeddings.embed_documents(texts[start:start + batch_size])
+    elapsed = time.perf_counter() - t
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux reports KiB
+    return load_s, n / elapsed, rss_mb
+
+
+def _embed_parity_run(n):
+    from langchain.embeddings import HuggingFaceEmbeddings
+    from config import EMBED_MODEL
+    from modules.fake_ollama import fake_invoice
+    from modules.onnx_embeddings import OnnxEmbeddings, parity_check
+    from modules.rag_store import build_document
+
+    texts = [build_document(fake_invoice(f"parity-{i}")).page_content for i in range(n)]
+    return parity_check(HuggingFaceEmbeddings(model_name=EMBED_MODEL), OnnxEmbeddings(), texts)
+
+
+def bench_embed(args):
+    """docs/s and peak RSS of each embedding backend on synthetic invoices, plus ONNX-vs-torch parity."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'backend':<10} {'docs':>6} {'load_s':>7} {'docs/s':>8} {'rss_mb':>8}")
+    for backend in args.backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            load_s, rate, rss = pool.submit(_embed_backend_run, backend, args.embed_docs, args.batch_size).result()
+        print(f"{backend:<10} {args.embed_docs:>6} {load_s:>7.2f} {rate:>8.1f} {rss:>8.0f}")
+    if "onnx-int8" in args.backends and "torch" in args.backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            print(f"parity (cosine, onnx-int8 vs torch): {pool.submit(_embed_parity_run, 200).result()}")
+
+
+def bench_context(args):
+    """RAG prompt size per question: whole pages vs. line-item chunks with compact context assembly."""
+    import shutil
+    import tempfile
+    import requests
+    from langchain.chains.retrieval_qa.prompt import PROMPT
+    from config import OLLAMA_MODEL, RETRIEVER_K, CHUNK_RETRIEVER_K
+    from modules.fake_ollama import fake_invoice
+    from modules.rag_context import estimate_tokens
+    from modules.rag_store import init_vectorstore, add_docs, HybridRetriever
+
+    invoices = [fake_invoice(f"context-{i}") for i in range(args.context_docs)]
+    vendor, number = invoices[0]["vendor"], invoices[0]["invoice_number"]
+    questions = [
+        f"What is the total of invoice {number}?",
+        f"Which items did we buy from {vendor}?",
+        "How much did we pay for toner?",
+        f"List the invoices from {vendor} over 500",
+    ]
+    setups = (("document", "pages", RETRIEVER_K, False),
+              ("document", "assembled", RETRIEVER_K, True),
+              ("items", "assembled", CHUNK_RETRIEVER_K, True))
+    measure = not args.offline
+    print(f"{'chunking':<9} {'context':<10} {'est_tokens':>10} {'prompt_tokens':>13}  question")
+    for chunking, label, k, assemble in setups:
+        tmp = tempfile.mkdtemp()
+        try:
+            vectorstore = init_vectorstore(persist_directory=tmp)
+            add_docs(vectorstore, invoices, chunking=chunking)
+            retriever = HybridRetriever(vectorstore=vectorstore, k=k, assemble=assemble, use_filters=True)
+            totals = []
+            for question in questions:
+                docs = retriever.invoke(question)
+                prompt = PROMPT.format(context="\n\n".join(d.page_content for d in docs), question=question)
+                measured = ""
+                if measure:
+                    # num_predict=1: only the prompt evaluation matters here
+                    data = requests.post(f"{args.base_url}/api/generate", timeout=300, json={
+                        "model": OLLAMA_MODEL, "prompt": prompt, "stream": False, "options": {"num_predict": 1}
+                    }).json()
+                    measured = data.get("prompt_eval_count", "")
+                totals.append(estimate_tokens(prompt))
+                print(f"{chunking:<9} {label:<10} {totals[-1]:>10} {measured:>13}  {question}")
+            print(f"{chunking:<9} {label:<10} {sum(totals) / len(totals):>10.0f} {'':>13}  (mean)")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_rag(args):
+    """rag_query before (top-k raw pages) and after retrieval post-processing: prompt tokens and answer latency."""
+    import shutil
+    import tempfile
+    from langchain.chains import RetrievalQA
+    from config import RETRIEVER_K, CHUNK_RETRIEVER_K, CHUNKING_MODE
+    from modules.fake_ollama import fake_invoice
+    from modules.llm_provider import OllamaLLM
+    from modules.rag_context import estimate_tokens
+    from modules.rag_store import init_vectorstore, add_docs, HybridRetriever
+    from modules.telemetry import load_records
+
+    invoices = [fake_invoice(f"rag-{i}") for i in range(args.context_docs)]
+    vendor = invoices[0]["vendor"]
+    questions = [
+        f"What is the total of invoice {invoices[0]['invoice_number']}?",
+        f"Which items did we buy from {vendor}?",
+        "How much did we pay for toner?",
+        "Which invoices include a desk lamp?",
+    ]
+    raw = dict(rerank=False, assemble=False, drop_empty=False)
+    setups = (("before", "document", RETRIEVER_K, raw),
+              ("after", CHUNKING_MODE, CHUNK_RETRIEVER_K if CHUNKING_MODE == "items" else RETRIEVER_K, {}))
+    print(f"{'setup':<7} {'est_tokens':>10} {'prompt_tokens':>13} {'retrieve_ms':>11} {'answer_s':>8}  question")
+    for label, chunking, k, options in setups:
+        tmp = tempfile.mkdtemp()
+        try:
+            vectorstore = init_vectorstore(persist_directory=tmp)
+            add_docs(vectorstore, invoices, chunking=chunking)
+            retriever = HybridRetriever(vectorstore=vectorstore, k=k, **options)
+            llm = OllamaLLM(base_url=args.base_url, use_response_cache=False, streaming=False, call_site="bench-rag")
+            chain = RetrievalQA.from_chain_type(llm=llm, retriever=retriever)
+            for question in questions:
+                t = time.perf_counter()
+                docs = retriever.invoke(question)
+                retrieve_ms = (time.perf_counter() - t) * 1000
+                tokens = estimate_tokens("\n\n".join(d.page_content for d in docs))
+                prompt_tokens, answer_s = "", ""
+                if not args.offline:
+                    t = time.perf_counter()
+                    chain.run(question)
+                    answer_s = f"{time.perf_counter() - t:.2f}"
+                    records = [r for r in load_records() if r["site"] == "bench-rag"]
+                    prompt_tokens = records[-1]["prompt_tokens"] if records else ""
+                print(f"{label:<7} {tokens:>10} {prompt_tokens:>13} {retrieve_ms:>11.1f} {answer_s:>8}  {question}")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+BENCHMARKS = {
+    "add-docs": bench_add_docs,
+    "context": bench_context,
+    "embed": bench_embed,
+    "load": bench_load,
+    "preprocess": bench_preprocess,
+    "rag": bench_rag,
+    "startup": bench_startup,
+    "tiling": bench_tiling,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the invoice pipeline.")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--base-url", default=OLLAMA_BASE_URL)
+    parser.add_argument("--dataset", default=DATASET_DIR, help="Directory of sample images")
+    parser.add_argument("--offline", action="store_true", help="Skip benchmark steps that need Ollama")
+    parser.add_argument("--items", type=int, nargs="+", default=[40, 80, 160],
+                        help="tiling: line items per synthetic receipt")
+    parser.add_argument("--requests", type=int, default=32, help="load: requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8],
+                        help="load: concurrency levels to test")
+    parser.add_argument("--docs", type=int, nargs="+", default=[1000, 10000],
+                        help="add-docs: synthetic invoices per run")
+    parser.add_argument("--batch-size", type=int, default=ADD_DOCS_BATCH_SIZE, help="add-docs: documents per batch")
+    parser.add_argument("--sessions", type=int, default=3, help="startup: simulated user sessions")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx-int8"], help="embed: backends to compare")
+    parser.add_argument("--embed-docs", type=int, default=2000, help="embed: synthetic invoices to encode")
+    parser.add_argument("--context-docs", type=int, default=200, help="context, rag: synthetic invoices to index")
+    parser.add_argument("--fake", action="store_true",
+                        help="Run against a local fake Ollama server (no GPU or network needed)")
+    parser.add_argument("--fake-latency", type=float, default=0.2, help="fake: mean response latency (s)")
+    parser.add_argument("--fake-error-rate", type=float, default=0.0, help="fake: share of requests failing")
+    parser.add_argument("--fake-endpoints", type=int, default=1, help="fake: servers to load-balance across")
+    args = parser.parse_args()
+    if not args.fake:
+        BENCHMARKS[args.benchmark](args)
+        return
+    from modules.fake_ollama import FakeOllama
+    from modules.ollama_client import register_router
+    latency = {"dist": "lognormal", "mean": args.fake_latency, "sigma": 0.4}
+    servers = [FakeOllama(latency=latency, token_delay=0.001, error_rate=args.fake_error_rate).start()
+               for _ in range(args.fake_endpoints)]
+    try:
+        args.base_url = servers[0].base_url
+        router = register_router(args.base_url, [server.base_url for server in servers])
+        BENCHMARKS[args.benchmark](args)
+        for server, endpoint in zip(servers, router.stats()):
+            print(f"fake server {server.base_url}: {server.stats}, loaded {endpoint['loaded']}")
+    finally:
+        for server in servers:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# bulk_ingest.py
+# Usage: python bulk_ingest.py docs/ [--workers 4] [--base-url http://127.0.0.1:11501]
+#        python bulk_ingest.py docs/ --durable   (queue in data/jobs.db, resumable)
+#        python bulk_ingest.py --resume          (finish jobs left by a crashed run)
+
+import argparse
+from config import OCR_MAX_WORKERS, OLLAMA_BASE_URL, SCHED_BULK_CONCURRENCY
+from modules.rag_store import init_vectorstore
+from modules.ingest import ingest_images, print_report, iter_image_paths
+from modules.job_queue import get_job_queue
+from modules.scheduler import configure_scheduler
+
+parser = argparse.ArgumentParser(description="OCR and index a directory of invoice images and PDFs.")
+parser.add_argument("source", nargs="?", help="Directory with .jpg/.jpeg/.png/.pdf files")
+parser.add_argument("--workers", type=int, default=OCR_MAX_WORKERS)
+parser.add_argument("--base-url", default=OLLAMA_BASE_URL)
+parser.add_argument("--no-log", action="store_true", help="Skip writing data/parsed_docs.jsonl")
+parser.add_argument("--durable", action="store_true", help="Run through the crash-safe job queue")
+parser.add_argument("--resume", action="store_true", help="Only finish unfinished jobs in the queue")
+args = parser.parse_args()
+if not args.source and not args.resume:
+    parser.error("source is required unless --resume is given")
+
+# A separate process from the app, with its own scheduler: stay within the bulk share of
+# the Ollama concurrency (all calls here are batch work, so no interactive reserve)
+configure_scheduler(max_limit=SCHED_BULK_CONCURRENCY, interactive_reserve=0)
+
+vs = init_vectorstore()
+if args.durable or args.resume:
+    queue = get_job_queue()
+    if args.resume:
+        print(f"Released {queue.release_leases()} jobs claimed by a previous run.")
+    if args.source:
+        job_ids = [queue.enqueue(path) for path in iter_image_paths(args.source)]
+        # Files ingested before the vector store was cleared are stored again
+        requeued = queue.requeue_missing(vs, job_ids)
+        if requeued:
+            print(f"Re-queued {requeued} done jobs whose documents are no longer stored.")
+    print(queue.run(vs, workers=args.workers, max_workers=1, base_url=args.base_url))
+else:
+    report = ingest_images(args.source, vs, max_workers=args.workers,
+                           log=not args.no_log, base_url=args.base_url)
+    print_report(report)
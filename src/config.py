@@ -8,3 +8,147 @@ OLLAMA_BASE_URL = "http://127.0.0.1:11501"
 OLLAMA_MODEL = "llama3"  # Change to 'mistral' or 'gemma' if preferred
 OLLAMA_OCR_MODEL = "qwen2.5vl:7b"  # Change to other ...
 
+
+# Bulk ingestion
+OCR_MAX_WORKERS = 4  # Keep in line with OLLAMA_NUM_PARALLEL on the server
+OLLAMA_POOL_SIZE = 8  # Max pooled HTTP connections to Ollama
+ADD_DOCS_BATCH_SIZE = 256  # Documents (with all their chunks) embedded and inserted per Chroma write in add_docs
+EMBED_BATCH_SIZE = 64  # Sentence-transformer encode batch size
+
+# Embedding model and its persistent vector cache (keyed by model + text hash, float16)
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_WARMUP = True  # Load the model and run one encode when the app server starts
+# Embedding backend: "torch" (sentence-transformers) or "onnx-int8" (ONNX Runtime, int8 weights, CPU)
+EMBED_BACKEND = "torch"
+EMBED_ONNX_DIR = os.path.join(DATA_DIR, "onnx", "all-MiniLM-L6-v2")
+EMBED_ONNX_THREADS = os.cpu_count()
+EMBED_PARITY_MIN = 0.99  # Min cosine similarity to the torch vectors for the ONNX parity check
+EMBED_CACHE_ENABLED = True
+EMBED_CACHE_PATH = os.path.join(DATA_DIR, "embedding_cache.db")
+EMBED_CACHE_MAX_BYTES = 256 * 1024 * 1024  # LRU eviction above this size
+
+# Retrieval for rag_query: exact identifier/vendor matches + BM25 + vectors, fused by reciprocal rank
+HYBRID_RETRIEVAL = True
+HYBRID_ID_FIELDS = ["invoice_number", "check_number", "po_number"]
+RETRIEVER_K = 4         # Documents handed to the LLM
+RETRIEVER_FETCH_K = 20  # Candidates taken from BM25 and from the vector search before fusion
+RRF_K = 60              # Reciprocal rank fusion constant
+
+# Metadata filters from questions (vendor/date/type/amount constraints)
+QUERY_FILTERS = True
+QUERY_FILTER_LLM_FALLBACK = True  # Ask the LLM for filters when the rules find none but the question names a value
+
+# Chunking of stored documents
+CHUNKING_MODE = "items"       # "document": one page per invoice; "items": header chunk + one chunk per line item
+CHUNK_RETRIEVER_K = 8         # Chunks retrieved in "items" mode (they are small)
+
+# Context assembly: what of the retrieved documents goes into the RAG prompt
+CONTEXT_ASSEMBLY = True       # Send compact header lines + matched items instead of whole pages
+CONTEXT_TOKEN_BUDGET = 1200   # Approximate tokens of retrieved context per RAG prompt
+CONTEXT_DROP_EMPTY_FIELDS = True  # Leave "Check #:"-style lines without a value out of pages sent to the LLM
+
+# Reranking of retrieved candidates for rag_query
+RERANK_ENABLED = True
+RERANKER = "cross-encoder"    # "cross-encoder" (sentence-transformers, CPU) or "lexical" (BM25 over the candidates)
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_FETCH_K = 20           # Candidates over-fetched before reranking down to the retriever's k
+
+# OCR result cache (keyed by image hash + OCR model + prompt hash)
+OCR_CACHE_ENABLED = True
+OCR_CACHE_PATH = os.path.join(DATA_DIR, "ocr_cache.db")
+OCR_CACHE_MAX_BYTES = 64 * 1024 * 1024  # LRU eviction above this size
+
+# Image preprocessing before OCR (set "enabled" to False to send raw file bytes)
+OCR_PREPROCESS = {
+    "enabled": True,
+    "max_edge": 1600,      # Longest side in pixels after downscaling (None = keep)
+    "max_pixels": None,    # Alternative pixel budget, e.g. 1_500_000 (None = keep)
+    "grayscale": False,
+    "binarize": None,      # Threshold 0-255 for black/white output (None = off, implies grayscale)
+    "autocrop": True,      # Trim uniform background margins
+    "format": "JPEG",      # "JPEG" or "WEBP"
+    "quality": 85,
+}
+
+# Stream OCR tokens in the UI and stop generation once the JSON object closes
+OCR_STREAMING = True
+
+# Send the invoice JSON schema as Ollama's `format` so decoding is constrained
+OCR_STRUCTURED_OUTPUT = True
+
+# PDF ingestion
+OCR_PDF_DPI = 150  # Rasterization resolution for PDF pages
+
+# Tiled OCR for very tall images (long receipts)
+OCR_TILING = {
+    "enabled": True,
+    "min_aspect": 2.5,     # Tile when height / width exceeds this
+    "strip_aspect": 1.4,   # Strip height as a multiple of the image width
+    "overlap": 0.15,       # Fraction of each strip repeated in the next one
+}
+
+# OCR model cascade: try the fast model first, re-run on OLLAMA_OCR_MODEL only if checks fail
+OCR_CASCADE = False  # Requires OLLAMA_OCR_FAST_MODEL to be pulled on the server
+OLLAMA_OCR_FAST_MODEL = "qwen2.5vl:3b"
+OCR_REQUIRED_FIELDS = ["vendor", "date", "total"]
+OCR_AMOUNT_TOLERANCE = 0.02  # Relative tolerance for the arithmetic checks
+
+# Durable ingestion job queue
+JOB_DB_PATH = os.path.join(DATA_DIR, "jobs.db")
+JOB_MAX_ATTEMPTS = 3
+JOB_LEASE_SECONDS = 900  # A claimed job is handed out again after this long (worker crashed)
+JOB_RETRY_BACKOFF = 30   # Seconds before a failed job is retried, doubled per attempt (rides out Ollama outages)
+
+# Ollama HTTP client
+OLLAMA_KEEP_ALIVE = "30m"    # How long Ollama keeps a model loaded after a request
+OLLAMA_CONNECT_TIMEOUT = 5   # Seconds
+OLLAMA_READ_TIMEOUT = 600    # Seconds; VLM calls on large images can be slow
+OLLAMA_MAX_RETRIES = 2       # Retries on 502/503/504, and on connection errors with a single endpoint
+OLLAMA_RETRY_BACKOFF = 0.5   # Seconds, doubled on each retry
+OLLAMA_MAX_CONCURRENCY = 4   # Prompts in flight for one batch/abatch call
+
+# Ollama instances the client balances across. "models" lists what an instance is meant to
+# serve (empty = anything); keeping OCR and chat models on different instances keeps both warm.
+# Requests to OLLAMA_BASE_URL are routed across these endpoints.
+OLLAMA_ENDPOINTS = [
+    {"url": OLLAMA_BASE_URL, "models": []},
+    # {"url": "http://gpu-node-2:11501", "models": [OLLAMA_OCR_MODEL]},
+    # {"url": "http://gpu-node-3:11501", "models": [OLLAMA_MODEL]},
+]
+OLLAMA_HEALTH_INTERVAL = 15   # Seconds between endpoint health checks
+OLLAMA_EJECT_AFTER = 3        # Consecutive server errors before an endpoint is ejected
+OLLAMA_EJECT_SECONDS = 30     # Ejection time before an endpoint gets traffic again
+OLLAMA_SPILL_OUTSTANDING = 4  # Leave the warm endpoint for a cold one once this many requests queue on it
+
+# Adaptive scheduler in front of every model call: interactive questions before batch OCR
+SCHED_ENABLED = True
+SCHED_MIN_CONCURRENCY = 1
+SCHED_MAX_CONCURRENCY = 8        # Upper bound for the adaptive limit (sum of OLLAMA_NUM_PARALLEL)
+SCHED_INITIAL_CONCURRENCY = 4
+SCHED_LATENCY_TOLERANCE = 2.0    # A call slower than this multiple of the best seen counts as congestion
+SCHED_BACKOFF = 0.75             # Multiplicative decrease of the limit on congestion
+SCHED_INTERACTIVE_RESERVE = 1    # Slots batch work may never take
+SCHED_QUEUE_LIMITS = {"interactive": 16, "batch": 64}  # Full: interactive is rejected, batch waits
+# The scheduler is per process, so interactive-before-batch ordering only holds within one
+# process. The Streamlit app and a concurrent bulk_ingest.py run split SCHED_MAX_CONCURRENCY:
+SCHED_BULK_CONCURRENCY = 3       # Max concurrent model calls of a bulk_ingest.py process
+SCHED_APP_CONCURRENCY = SCHED_MAX_CONCURRENCY - SCHED_BULK_CONCURRENCY  # ... of the app (questions + uploads)
+
+# Stream agent tokens so the UI can show the final answer as it is generated
+LLM_STREAMING = True
+
+# LLM response cache (exact prompt level + optional semantic question level)
+LLM_CACHE_ENABLED = True
+LLM_CACHE_MAX_ENTRIES = 512
+LLM_CACHE_TTL = 3600          # Seconds
+LLM_SEMANTIC_CACHE = False    # Off by default: reuses answers across reworded questions
+LLM_SEMANTIC_THRESHOLD = 0.95  # Cosine similarity needed to reuse an answer for a reworded question
+
+# Identical concurrent LLM prompts / OCR images wait on one in-flight request instead of re-running it
+SINGLE_FLIGHT_ENABLED = True
+
+# Ollama performance telemetry (one JSON line per model call)
+OLLAMA_METRICS_ENABLED = True
+OLLAMA_METRICS_PATH = os.path.join(DATA_DIR, "ollama_metrics.jsonl")
+OLLAMA_METRICS_MAX_BYTES = 20 * 1024 * 1024  # Rotated to <path>.1 above this size
+OLLAMA_COLD_LOAD_S = 1.0  # load_duration above this counts as a model (re)load
@@ -6,13 +6,16 @@ import pandas as pd
 
 def build_dataframe_from_vectorstore(vectorstore):
     """Load all documents from Chroma and convert to pandas DataFrames (main, line items)."""
-    docs = vectorstore.similarity_search("", k=1000)  # Load all docs
+    metadatas = vectorstore.get(include=["metadatas"])["metadatas"]
 
     main_rows = []
     item_rows = []
 
-    for doc in docs:
-        meta = doc.metadata
+    for meta in metadatas:
+        meta = meta or {}
+        # Line-item chunks repeat rows of their parent document
+        if meta.get("chunk") == "item":
+            continue
         # Attempt to parse 'items' from JSON string to list
         items = []
         if isinstance(meta.get("items"), str):
@@ -0,0 +1,61 @@
+# modules/bm25.py
+
+import heapq
+import math
+import re
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lower-cased alphanumeric terms, as used by every keyword index here."""
+    return TOKEN.findall(str(text or "").lower())
+
+
+class BM25:
+    """
+    Okapi BM25 over a set of texts keyed by ID, updated in place. Not thread-safe:
+    callers that share one hold their own lock.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {id: term frequency}
+        self.lengths = {}
+        self.total_length = 0
+
+    def add(self, key, text):
+        terms = tokenize(text)
+        for term in terms:
+            tf = self.postings.setdefault(term, {})
+            tf[key] = tf.get(key, 0) + 1
+        self.lengths[key] = len(terms)
+        self.total_length += len(terms)
+
+    def remove(self, key, text):
+        """Forget `key`; `text` is what it was added with."""
+        for term in set(tokenize(text)):
+            self.postings.get(term, {}).pop(key, None)
+        self.total_length -= self.lengths.pop(key, 0)
+
+    def scores(self, query):
+        """{id: score} for the texts sharing at least one term with `query`."""
+        n = len(self.lengths)
+        if not n:
+            return {}
+        avg_length = self.total_length / n or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            tf = self.postings.get(term)
+            if not tf:
+                continue
+            idf = math.log(1 + (n - len(tf) + 0.5) / (len(tf) + 0.5))
+            for key, freq in tf.items():
+                norm = freq + self.k1 * (1 - self.b + self.b * self.lengths[key] / avg_length)
+                scores[key] = scores.get(key, 0.0) + idf * freq * (self.k1 + 1) / norm
+        return scores
+
+    def top(self, query, k):
+        scores = self.scores(query)
+        return heapq.nlargest(k, scores, key=scores.get)
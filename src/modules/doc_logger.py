@@ -15,6 +15,18 @@ def log_doc(parsed_data: dict):
         f.write("\n")
 
 
+def is_logged(doc_id):
+    """True if a document with this `id` was already appended to the log."""
+    if not LOG_FILE.exists():
+        return False
+    needle = json.dumps(doc_id)
+    with open(LOG_FILE, encoding="utf-8") as f:
+        for line in f:
+            if needle in line and json.loads(line).get("id") == doc_id:
+                return True
+    return False
+
+
 def export_vectorstore_to_jsonl(vectorstore):
     """
     Export all documents from the vector store to a .jsonl file.
@@ -0,0 +1,191 @@
+# modules/embedding_cache.py
+
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from typing import List
+from langchain.schema.embeddings import Embeddings
+from config import EMBED_CACHE_PATH, EMBED_CACHE_MAX_BYTES
+from modules.ocr_cache import sha256_hex
+
+# SQLite caps the number of bound parameters per statement
+_CHUNK = 500
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of embedding vectors, keyed by (model, kind, SHA-256 of the text).
+
+    Vectors are stored as float16 blobs in SQLite (768 bytes for a 384-dim MiniLM
+    vector). When the total blob size exceeds `max_bytes`, the least recently used
+    entries are evicted. Hit/miss counters are kept per process.
+    """
+
+    def __init__(self, path=EMBED_CACHE_PATH, max_bytes=EMBED_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, kind, text_hash)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_lru ON embedding_cache(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def pack(vector):
+        return np.asarray(vector, dtype=np.float16).tobytes()
+
+    @staticmethod
+    def unpack(blob):
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32).tolist()
+
+    def get_many(self, model, kind, text_hashes):
+        """Return {text_hash: vector} for the hashes that are cached."""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(text_hashes), _CHUNK):
+                chunk = text_hashes[start:start + _CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embedding_cache "
+                    f"WHERE model=? AND kind=? AND text_hash IN ({marks})", (model, kind, *chunk)
+                ).fetchall()
+                found.update((h, self.unpack(blob)) for h, blob in rows)
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embedding_cache SET last_access=? "
+                        f"WHERE model=? AND kind=? AND text_hash IN ({','.join('?' * len(rows))})",
+                        (now, model, kind, *(h for h, _ in rows))
+                    )
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(text_hashes)) - len(found)
+        return found
+
+    def put_many(self, model, kind, items):
+        """Store (text_hash, vector) pairs."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?, ?, ?)",
+                [(model, kind, h, self.pack(v), now) for h, v in items]
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Evict down to 90% so a full cache does not scan on every insert
+        excess = total - int(self.max_bytes * 0.9)
+        rows = self._conn.execute(
+            "SELECT rowid, LENGTH(vector) FROM embedding_cache ORDER BY last_access"
+        ).fetchall()
+        doomed = []
+        for rowid, size in rows:
+            if excess <= 0:
+                break
+            doomed.append((rowid,))
+            excess -= size
+        self._conn.executemany("DELETE FROM embedding_cache WHERE rowid=?", doomed)
+
+    def invalidate(self, model=None):
+        """Drop cached vectors of `model`, or all of them. Returns the number of rows deleted."""
+        with self._lock:
+            if model is not None:
+                cur = self._conn.execute("DELETE FROM embedding_cache WHERE model=?", (model,))
+            else:
+                cur = self._conn.execute("DELETE FROM embedding_cache")
+            self._conn.commit()
+        return cur.rowcount
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with an EmbeddingCache: only texts not seen before reach
+    the encoder, in one batch. Every vector goes through float16, so a text gets the
+    same vector whether it was a hit or a miss.
+    """
+
+    def __init__(self, embeddings, model_name, cache):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    def _embed(self, kind, texts, encode):
+        hashes = [sha256_hex(text) for text in texts]
+        found = self.cache.get_many(self.model_name, kind, list(set(hashes)))
+        missing = {}
+        for text, h in zip(texts, hashes):
+            if h not in found:
+                missing.setdefault(h, text)
+        if missing:
+            vectors = encode(list(missing.values()))
+            new = [(h, EmbeddingCache.unpack(EmbeddingCache.pack(v))) for h, v in zip(missing, vectors)]
+            self.cache.put_many(self.model_name, kind, new)
+            found.update(new)
+        return [found[h] for h in hashes]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("doc", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("query", [text], lambda t: [self.embeddings.embed_query(t[0])])[0]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Return the process-wide embedding cache (opened on first use)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
+
+
+if __name__ == "__main__":
+    # python -m modules.embedding_cache [stats | clear | drop-model <name>]
+    import sys
+
+    cache = get_embedding_cache()
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if cmd == "clear":
+        print(f"Removed {cache.invalidate()} entries.")
+    elif cmd == "drop-model":
+        print(f"Removed {cache.invalidate(model=sys.argv[2])} entries.")
+    else:
+        print(cache.stats())
@@ -0,0 +1,277 @@
+# modules/fake_ollama.py
+
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+NS = 1_000_000_000
+
+VENDORS = ["Acme Inc.", "Globex GmbH", "Initech LLC", "Umbrella Corp", "Stark Supplies"]
+ITEMS = ["Paper A4", "Toner", "Stapler", "Desk Lamp", "USB Cable", "Coffee Beans", "Notebook"]
+
+
+def sample_latency(spec, rng):
+    """Draw a delay in seconds from a latency spec such as {"dist": "lognormal", "mean": 0.5, "sigma": 0.4}."""
+    if not spec:
+        return 0.0
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    dist = spec.get("dist", "constant")
+    if dist == "uniform":
+        return rng.uniform(spec.get("low", 0.0), spec.get("high", 1.0))
+    if dist == "lognormal":
+        mean, sigma = spec.get("mean", 0.5), spec.get("sigma", 0.5)
+        # Parametrized so that the distribution's mean is `mean`
+        return rng.lognormvariate(0, sigma) * mean / pow(2.718281828, sigma ** 2 / 2)
+    return float(spec.get("value", spec.get("mean", 0.0)))
+
+
+def fake_invoice(seed_text):
+    """Deterministic invoice JSON derived from the request content (e.g. the image bytes)."""
+    rng = random.Random(hashlib.sha256(seed_text.encode("utf-8")).hexdigest())
+    items = []
+    for _ in range(rng.randint(1, 5)):
+        qty, price = rng.randint(1, 4), round(rng.uniform(1, 80), 2)
+        items.append({"item": rng.choice(ITEMS), "qty": str(qty), "price": f"{price:.2f}",
+                      "total": f"{qty * price:.2f}"})
+    subtotal = round(sum(float(i["total"]) for i in items), 2)
+    tax = round(subtotal * 0.19, 2)
+    return {
+        "invoice_number": str(rng.randint(1000, 9999)), "check_number": "", "po_number": "",
+        "vendor": rng.choice(VENDORS), "vendor_address": "1 Main St, Springfield",
+        "customer_name": "Bonn University", "customer_address": "Regina-Pacis-Weg 3, Bonn",
+        "date": f"2023-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}", "due_date": "", "payment_date": "",
+        "amount": f"{subtotal:.2f}", "subtotal": f"{subtotal:.2f}", "tax": f"{tax:.2f}", "VAT": f"{tax:.2f}",
+        "discount": "", "total": f"{subtotal + tax:.2f}", "currency": "EUR", "payment_method": "bank transfer",
+        "account_number": "", "routing_number": "", "bank_name": "Sparkasse",
+        "items": items, "document_type": "invoice", "notes": "",
+    }
+
+
+def default_responder(request):
+    """
+    Canned output by prompt type: invoice JSON for OCR requests (images attached),
+    a structured-chat Final Answer for agent prompts and a short answer otherwise.
+    """
+    prompt = request.get("prompt", "")
+    if request.get("images"):
+        return json.dumps(fake_invoice(request["images"][0][:4096]), indent=2)
+    if '"action"' in prompt and "Final Answer" in prompt:
+        answer = f"Stub answer to: {prompt.strip().splitlines()[-1][:80]}"
+        return "Action:\n```\n" + json.dumps({"action": "Final Answer", "action_input": answer}, indent=2) + "\n```"
+    return f"Stub answer ({len(prompt)} prompt characters)."
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing kept-alive connections or cutting streams short is routine here
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class FakeOllama:
+    """
+    Local stand-in for an Ollama server, for benchmarks and tests without a GPU.
+
+    Implements /api/generate and /api/chat (blocking and NDJSON streaming, with Ollama's
+    timing fields), /api/tags and /api/ps. Latency is drawn from `latency` (see
+    `sample_latency`) plus `token_delay` per generated token, the first request per model
+    pays `load_delay`, `error_rate` injects HTTP 500s, and at most `num_parallel`
+    requests are served at once with up to `max_queue` waiting (503 beyond that),
+    mirroring OLLAMA_NUM_PARALLEL.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=None, token_delay=0.0, load_delay=0.0,
+                 error_rate=0.0, num_parallel=4, max_queue=64, models=None, responder=default_responder,
+                 seed=0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.load_delay = load_delay
+        self.error_rate = error_rate
+        self.max_queue = max_queue
+        self.models = models or ["llama3", "qwen2.5vl:7b", "qwen2.5vl:3b"]
+        self.responder = responder
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "errors": 0, "rejected": 0, "max_active": 0}
+        self._active = 0
+        self._waiting = 0
+        self._loaded = set()
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(num_parallel)
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+        self._stopped = False
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True  # Also drop requests arriving on kept-alive connections
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if fake._stopped:
+                    self.close_connection = True
+                    return
+                if self.path == "/api/tags":
+                    self._send_json(200, {"models": [{"name": m, "model": m} for m in fake.models]})
+                elif self.path == "/api/ps":
+                    self._send_json(200, {"models": [{"name": m, "model": m} for m in sorted(fake._loaded)]})
+                else:
+                    self._send_json(200, {"status": "Ollama is running"})
+
+            def do_POST(self):
+                if fake._stopped:
+                    self.close_connection = True
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path not in ("/api/generate", "/api/chat"):
+                    self._send_json(404, {"error": "not found"})
+                    return
+                fake._serve(self, body, chat=self.path == "/api/chat")
+
+        return Handler
+
+    def _serve(self, handler, body, chat):
+        with self._lock:
+            self.stats["requests"] += 1
+            if self._waiting >= self.max_queue:
+                self.stats["rejected"] += 1
+                handler._send_json(503, {"error": "server busy, please try again"})
+                return
+            self._waiting += 1
+        with self._slots:
+            with self._lock:
+                self._waiting -= 1
+                self._active += 1
+                self.stats["max_active"] = max(self.stats["max_active"], self._active)
+                fail = self.rng.random() < self.error_rate
+                if fail:
+                    self.stats["errors"] += 1
+                delay = sample_latency(self.latency, self.rng)
+                model = body.get("model", "")
+                cold = model not in self._loaded
+                self._loaded.add(model)
+            try:
+                if fail:
+                    handler._send_json(500, {"error": "injected failure"})
+                    return
+                self._respond(handler, body, chat, delay, self.load_delay if cold else 0.0)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Client went away (e.g. early stop of a stream)
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+    def _respond(self, handler, body, chat, delay, load_s):
+        start = time.perf_counter()
+        if chat:
+            messages = body.get("messages", [])
+            request = {"prompt": "\n".join(m.get("content", "") for m in messages),
+                       "images": [img for m in messages for img in m.get("images", [])]}
+        else:
+            request = body
+        text = self.responder(request)
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)] or [""]
+        prompt_tokens = max(len(request.get("prompt", "")) // 4, 1)
+        time.sleep(load_s + delay)
+
+        def final(eval_s):
+            total = time.perf_counter() - start
+            return {
+                "model": body.get("model", ""), "done": True, "done_reason": "stop",
+                "total_duration": int(total * NS), "load_duration": int(load_s * NS),
+                "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(delay * NS),
+                "eval_count": len(tokens), "eval_duration": int(max(eval_s, 1e-6) * NS),
+            }
+
+        def piece(token):
+            if chat:
+                return {"message": {"role": "assistant", "content": token}}
+            return {"response": token}
+
+        if body.get("stream", True) is False:
+            t = time.perf_counter()
+            time.sleep(self.token_delay * len(tokens))
+            result = {**final(time.perf_counter() - t), **piece(text)}
+            handler._send_json(200, result)
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/x-ndjson")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+
+        def write_chunk(obj):
+            data = (json.dumps(obj) + "\n").encode("utf-8")
+            handler.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            handler.wfile.flush()
+
+        t = time.perf_counter()
+        for token in tokens:
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            write_chunk({"model": body.get("model", ""), "done": False, **piece(token)})
+        write_chunk({**final(time.perf_counter() - t), **piece("")})
+        handler.wfile.write(b"0\r\n\r\n")
+        handler.wfile.flush()
+
+
+if __name__ == "__main__":
+    # python -m modules.fake_ollama --port 11501 --latency 0.5 --token-delay 0.01
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local stand-in Ollama server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11501)
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean response latency (s, lognormal)")
+    parser.add_argument("--sigma", type=float, default=0.4)
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds per generated token")
+    parser.add_argument("--load-delay", type=float, default=2.0, help="First-request model load time (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--num-parallel", type=int, default=4)
+    args = parser.parse_args()
+
+    server = FakeOllama(args.host, args.port, latency={"dist": "lognormal", "mean": args.latency, "sigma": args.sigma},
+                        token_delay=args.token_delay, load_delay=args.load_delay, error_rate=args.error_rate,
+                        num_parallel=args.num_parallel)
+    print(f"Fake Ollama listening on {server.base_url}")
+    server.start()._thread.join()
@@ -0,0 +1,139 @@
+# modules/ingest.py
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from config import OCR_MAX_WORKERS, OLLAMA_BASE_URL
+from modules.ocr_parser import parse_document, parse_stats, cascade_stats
+from modules.rag_store import add_doc
+from modules.doc_logger import log_doc
+from modules.ollama_client import new_session
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".pdf")
+
+
+class StageStats:
+    """Counters for one pipeline stage (docs processed, failures, busy time)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.failed = 0
+        self.busy = 0.0
+
+    def add(self, seconds, ok=True):
+        self.busy += seconds
+        if ok:
+            self.count += 1
+        else:
+            self.failed += 1
+
+    def as_dict(self, wall):
+        return {
+            "count": self.count,
+            "failed": self.failed,
+            "busy_s": round(self.busy, 3),
+            "avg_s": round(self.busy / max(self.count + self.failed, 1), 3),
+            "docs_per_s": round(self.count / wall, 3) if wall else 0.0,
+        }
+
+
+def iter_image_paths(source):
+    """Yield image/PDF paths from a directory (sorted) or pass through an iterable of paths."""
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(source, name)
+    else:
+        yield from source
+
+
+def _timed_parse(image_path, session, base_url):
+    start = time.perf_counter()
+    # Documents already run in parallel here, so PDF pages / strips are OCR'd one at a time
+    parsed = parse_document(image_path, max_workers=1, session=session, base_url=base_url)
+    return image_path, parsed, time.perf_counter() - start
+
+
+def ingest_images(source, vectorstore, max_workers=OCR_MAX_WORKERS, log=True,
+                  base_url=OLLAMA_BASE_URL, on_doc=None):
+    """
+    OCR many images concurrently and feed each result into the vector store and the log.
+
+    OCR runs on a thread pool sharing one pooled HTTP session, with at most
+    `2 * max_workers` requests queued so huge directories do not pile up in memory.
+    Storing and logging stay on the calling thread, because Chroma writes are not
+    thread-safe. Returns a per-stage throughput report.
+    """
+    stats = {name: StageStats(name) for name in ("ocr", "store", "log")}
+    session = new_session(pool_size=max_workers)
+    paths = iter(iter_image_paths(source))
+    start = time.perf_counter()
+
+    def store(image_path, parsed, ocr_seconds):
+        stats["ocr"].add(ocr_seconds, ok=bool(parsed))
+        if not parsed:
+            return
+        # A document that cannot be stored or logged is counted as failed, not fatal to the run
+        t = time.perf_counter()
+        try:
+            add_doc(vectorstore, parsed)
+        except Exception as e:
+            print(f"[ERROR] Storing {image_path} failed: {e}")
+            stats["store"].add(time.perf_counter() - t, ok=False)
+            return
+        stats["store"].add(time.perf_counter() - t)
+        if log:
+            t = time.perf_counter()
+            try:
+                log_doc(parsed)
+                stats["log"].add(time.perf_counter() - t)
+            except Exception as e:
+                print(f"[ERROR] Logging {image_path} failed: {e}")
+                stats["log"].add(time.perf_counter() - t, ok=False)
+        if on_doc:
+            on_doc(image_path, parsed)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = {}
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < 2 * max_workers:
+                    try:
+                        path = next(paths)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[pool.submit(_timed_parse, path, session, base_url)] = path
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"[ERROR] OCR of {path} failed: {e}")
+                        stats["ocr"].add(0.0, ok=False)
+                        continue
+                    store(*result)
+    finally:
+        session.close()
+    wall = time.perf_counter() - start
+    report = {name: s.as_dict(wall) for name, s in stats.items()}
+    report["wall_s"] = round(wall, 3)
+    report["workers"] = max_workers
+    report["json_paths"] = parse_stats()
+    report["ocr_tiers"] = cascade_stats()
+    return report
+
+
+def print_report(report):
+    print(f"Ingested in {report['wall_s']}s with {report['workers']} OCR workers")
+    for name in ("ocr", "store", "log"):
+        r = report[name]
+        print(f"  {name:<6} {r['count']:>6} ok  {r['failed']:>4} failed  "
+              f"busy {r['busy_s']:>8}s  avg {r['avg_s']:>6}s  {r['docs_per_s']:>7} docs/s")
+    print(f"  JSON extraction paths: {report['json_paths']}")
+    print(f"  OCR tiers: {report['ocr_tiers']}")
@@ -0,0 +1,289 @@
+# modules/job_queue.py
+
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import JOB_DB_PATH, JOB_MAX_ATTEMPTS, JOB_LEASE_SECONDS, JOB_RETRY_BACKOFF, OCR_MAX_WORKERS
+from modules.ocr_parser import parse_document
+from modules.rag_store import add_doc
+from modules.doc_logger import log_doc, is_logged
+from modules.scheduler import QueueFullError
+
+# Stages run in this order; a job's `stage` column is the next stage still to run
+STAGES = ["parse", "embed", "log"]
+DONE, FAILED = "done", "failed"
+
+
+def file_job_id(path):
+    """Content-addressed job ID, so the same file is only ever ingested once."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:32]
+
+
+class JobQueue:
+    """
+    SQLite-backed ingestion queue for parse_document -> add_doc -> log_doc.
+
+    Every stage's output and timing is committed before the job moves on, so after a
+    crash a runner resumes each job at the stage it stopped in. Claimed jobs carry a
+    lease; jobs whose lease expired (their worker died) are handed out again. A failed
+    job waits `retry_backoff` seconds (doubled per attempt) before it is retried, so a
+    short Ollama outage does not use up its attempts. Stages are
+    idempotent: documents are stored under the job ID, which add_doc skips if present,
+    and replayed log stages check the log first.
+    """
+
+    def __init__(self, path=JOB_DB_PATH, max_attempts=JOB_MAX_ATTEMPTS, lease_seconds=JOB_LEASE_SECONDS,
+                 retry_backoff=JOB_RETRY_BACKOFF):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retry_backoff = retry_backoff
+        self.worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._store_lock = threading.Lock()  # Chroma and the log file are written by one thread at a time
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                parsed TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                lease_owner TEXT,
+                lease_until REAL NOT NULL DEFAULT 0,
+                parse_s REAL,
+                embed_s REAL,
+                log_s REAL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_stage ON jobs(stage, lease_until)")
+        self._conn.commit()
+
+    def _update(self, job_id, **columns):
+        columns["updated"] = time.time()
+        assignments = ", ".join(f"{name}=?" for name in columns)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id=?", (*columns.values(), job_id))
+            self._conn.commit()
+
+    def enqueue(self, path):
+        """Add a file to the queue (no-op if the same content was queued before). Returns the job ID."""
+        job_id = file_job_id(path)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, path, stage, created, updated) VALUES (?, ?, ?, ?, ?)",
+                (job_id, str(path), STAGES[0], now, now)
+            )
+            self._conn.commit()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, job_id=None):
+        """
+        Lease the next runnable job (or a specific one) to this process; None if there is
+        none. A specific job is handed out even while it waits out its retry backoff.
+        """
+        now = time.time()
+        query = "SELECT id FROM jobs WHERE stage NOT IN (?, ?) AND lease_until < ?"
+        params = [DONE, FAILED, now]
+        if job_id is not None:
+            query = "SELECT id FROM jobs WHERE stage NOT IN (?, ?) AND (lease_until < ? OR lease_owner IS NULL) AND id=?"
+            params.append(job_id)
+        with self._lock:
+            row = self._conn.execute(query + " ORDER BY created LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET lease_owner=?, lease_until=?, attempts=attempts+1, updated=? WHERE id=?",
+                (self.worker_name, now + self.lease_seconds, now, row["id"])
+            )
+            self._conn.commit()
+            job = self._conn.execute("SELECT * FROM jobs WHERE id=?", (row["id"],)).fetchone()
+        return dict(job)
+
+    def next_retry(self):
+        """When the earliest job waiting out its retry backoff becomes claimable; None if none is."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(lease_until) FROM jobs WHERE stage NOT IN (?, ?) AND lease_owner IS NULL AND lease_until > 0",
+                (DONE, FAILED)
+            ).fetchone()
+        return row[0]
+
+    def run_job(self, job, vectorstore, **parse_kwargs):
+        """
+        Run the remaining stages of a claimed job and return the parsed document.
+        Failures release the lease and hold the job back for the retry backoff; it is
+        retried until `max_attempts` is reached.
+        """
+        job_id = job["id"]
+        parsed = json.loads(job["parsed"]) if job["parsed"] else None
+        stage = job["stage"]
+        try:
+            if stage == "parse":
+                t = time.perf_counter()
+                parsed = parse_document(job["path"], **parse_kwargs)
+                if not parsed:
+                    raise RuntimeError("OCR returned no data")
+                stage = "embed"
+                self._update(job_id, stage=stage, parsed=json.dumps(parsed, ensure_ascii=False),
+                             parse_s=time.perf_counter() - t)
+
+            if stage == "embed":
+                t = time.perf_counter()
+                with self._store_lock:
+                    add_doc(vectorstore, parsed, doc_id=job_id)
+                stage = "log"
+                self._update(job_id, stage=stage, embed_s=time.perf_counter() - t)
+
+            if stage == "log":
+                t = time.perf_counter()
+                with self._store_lock:
+                    # A replayed or re-queued job may already be in the log
+                    if (job["attempts"] <= 1 and job["stage"] == STAGES[0]) or not is_logged(job_id):
+                        log_doc({**parsed, "id": job_id})
+                stage = DONE
+                self._update(job_id, stage=stage, log_s=time.perf_counter() - t,
+                             lease_owner=None, lease_until=0, error=None)
+        except QueueFullError:
+            # Turned away by the scheduler before any work was done: give the attempt back
+            self._update(job_id, attempts=job["attempts"] - 1, lease_owner=None, lease_until=0)
+            raise
+        except Exception as e:
+            print(f"[ERROR] Job {job_id} ({job['path']}) failed in stage '{stage}': {e}")
+            final = job["attempts"] >= self.max_attempts
+            retry_at = 0 if final else time.time() + self.retry_backoff * 2 ** (job["attempts"] - 1)
+            self._update(job_id, stage=FAILED if final else stage, error=str(e),
+                         lease_owner=None, lease_until=retry_at)
+            if final:
+                return None
+            raise
+        return parsed
+
+    def run(self, vectorstore, workers=OCR_MAX_WORKERS, **parse_kwargs):
+        """
+        Drain the queue with a pool of worker threads, resuming any unfinished jobs and
+        waiting for those in retry backoff. Returns the status counts and average stage
+        timings afterwards.
+        """
+        def worker():
+            while True:
+                job = self.claim()
+                if job is None:
+                    retry_at = self.next_retry()
+                    if retry_at is None:
+                        return
+                    time.sleep(max(0.0, retry_at - time.time()) + 0.01)
+                    continue
+                try:
+                    self.run_job(job, vectorstore, **parse_kwargs)
+                except Exception:
+                    pass  # Already recorded; the job is claimable again after its backoff
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in range(workers):
+                pool.submit(worker)
+        return self.status()
+
+    def release_leases(self):
+        """Make every claimed job runnable again (use when no other runner is alive)."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET lease_owner=NULL, lease_until=0 WHERE lease_until > 0 AND stage NOT IN (?, ?)",
+                (DONE, FAILED)
+            )
+            self._conn.commit()
+        return cur.rowcount
+
+    def retry_failed(self, job_ids=None):
+        """Give failed jobs (all, or those in `job_ids`) a fresh set of attempts, resuming at the stage that failed."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, parsed FROM jobs WHERE stage=?", (FAILED,)
+            ).fetchall()
+            if job_ids is not None:
+                rows = [row for row in rows if row["id"] in set(job_ids)]
+            for row in rows:
+                stage = "embed" if row["parsed"] else STAGES[0]
+                self._conn.execute(
+                    "UPDATE jobs SET stage=?, attempts=0, updated=? WHERE id=?", (stage, time.time(), row["id"])
+                )
+            self._conn.commit()
+        return len(rows)
+
+    def requeue_missing(self, vectorstore, job_ids=None):
+        """
+        Send done jobs whose document is no longer in the vector store (e.g. after it was
+        cleared) back to the embed stage, reusing their parsed output. Checks all done jobs,
+        or those in `job_ids`. Returns the number re-queued.
+        """
+        with self._lock:
+            ids = [row["id"] for row in self._conn.execute("SELECT id FROM jobs WHERE stage=?", (DONE,))]
+        if job_ids is not None:
+            ids = [i for i in ids if i in set(job_ids)]
+        stored = set()
+        for start in range(0, len(ids), 500):
+            stored.update(vectorstore.get(ids=ids[start:start + 500])["ids"])
+        missing = [i for i in ids if i not in stored]
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET stage=?, attempts=0, error=NULL, updated=? WHERE id=? AND stage=?",
+                [("embed", time.time(), i, DONE) for i in missing]
+            )
+            self._conn.commit()
+        return len(missing)
+
+    def status(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT stage, COUNT(*) FROM jobs GROUP BY stage").fetchall())
+            timings = self._conn.execute(
+                "SELECT AVG(parse_s), AVG(embed_s), AVG(log_s) FROM jobs WHERE stage=?", (DONE,)
+            ).fetchone()
+        return {
+            "jobs": counts,
+            "avg_s": {name: round(v, 3) if v is not None else None for name, v in zip(STAGES, timings)},
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the process-wide job queue (opened on first use)."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
+
+
+if __name__ == "__main__":
+    # python -m modules.job_queue [status | retry-failed]
+    import sys
+
+    queue = get_job_queue()
+    if len(sys.argv) > 1 and sys.argv[1] == "retry-failed":
+        print(f"Re-queued {queue.retry_failed()} failed jobs.")
+    print(queue.status())
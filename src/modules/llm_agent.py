@@ -1,9 +1,21 @@
 # modules/llm_agent.py
 
+import json
+import re
+import time
 from langchain.agents import Tool, initialize_agent, AgentExecutor, AgentType
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.tools import StructuredTool
 from langchain.chains import RetrievalQA
-from modules.llm_provider import OllamaLLM
+from langchain.retrievers import ContextualCompressionRetriever
+from config import (
+    LLM_STREAMING, LLM_CACHE_ENABLED, LLM_SEMANTIC_CACHE, HYBRID_RETRIEVAL, RETRIEVER_K, CHUNKING_MODE,
+    CHUNK_RETRIEVER_K, RERANK_ENABLED, RERANK_FETCH_K
+)
+from modules.llm_provider import OllamaLLM, get_response_cache
+from modules.query_filters import MONTHS, rule_filters
+from modules.rag_store import data_version, get_hybrid_index, HybridRetriever, RerankCompressor
+from modules.reranker import get_context_stats
 from modules.analytics import (
     monthly_summary, top_vendors, top_items,
     vendor_invoice_counts, average_invoice_amount, all_vendors,
@@ -13,19 +25,84 @@ from modules.analytics import (
 )
 
 
+_KEY_TERM = re.compile(r"[\w#/.-]*\d[\w/.-]*")
+_QUOTED_TERM = re.compile(r"['\"‘“]([^'\"’”]+)['\"’”]")
+# Agent outputs that report a failure rather than answer the question
+_FAILED_ANSWERS = ("Agent stopped due to", "Could not parse LLM output")
+_FINAL_ANSWER = re.compile(r'"action"\s*:\s*"Final Answer"\s*,\s*"action_input"\s*:\s*"')
+
+
+def partial_final_answer(text):
+    """Return the (possibly incomplete) Final Answer text from a structured-chat agent output, or None."""
+    match = _FINAL_ANSWER.search(text)
+    if not match:
+        return None
+    rest = text[match.end():]
+    escaped = False
+    for i, ch in enumerate(rest):
+        if escaped:
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == '"':
+            rest = rest[:i]
+            break
+    for candidate in (rest, rest[:-1]):  # the cut may fall inside an escape sequence
+        try:
+            return json.loads(f'"{candidate}"')
+        except ValueError:
+            pass
+    return rest
+
+
+class FinalAnswerStreamHandler(BaseCallbackHandler):
+    """Passes the agent's Final Answer to `on_text` token by token while the LLM is still generating it."""
+
+    def __init__(self, on_text):
+        self.on_text = on_text
+        self.buffer = ""
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.buffer = ""
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.buffer += token
+        answer = partial_final_answer(self.buffer)
+        if answer:
+            self.on_text(answer)
+
+
 def get_combined_agent(vectorstore, df_main, df_items) -> AgentExecutor:
     """
     Unified agent combining RAG and analytics tools using Ollama.
     """
-    llm = OllamaLLM()
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
-    rag_chain = RetrievalQA.from_chain_type(llm=llm, retriever=retriever)
+    llm = OllamaLLM(streaming=LLM_STREAMING, data_version=lambda: data_version(vectorstore))
+    rag_llm = OllamaLLM(call_site="rag", data_version=lambda: data_version(vectorstore))
+    # Line-item chunks are small, so more of them are retrieved
+    k = CHUNK_RETRIEVER_K if CHUNKING_MODE == "items" else RETRIEVER_K
+    if HYBRID_RETRIEVAL:
+        filter_llm = OllamaLLM(call_site="filters", streaming=False, data_version=lambda: data_version(vectorstore))
+        retriever = HybridRetriever(vectorstore=vectorstore, k=k, filter_llm=filter_llm)
+    elif RERANK_ENABLED:
+        retriever = ContextualCompressionRetriever(
+            base_compressor=RerankCompressor(top_n=k, vectorstore=vectorstore),
+            base_retriever=vectorstore.as_retriever(search_kwargs={"k": max(k, RERANK_FETCH_K)})
+        )
+    else:
+        retriever = vectorstore.as_retriever(search_kwargs={"k": k})
+    rag_chain = RetrievalQA.from_chain_type(llm=rag_llm, retriever=retriever)
+
+    def rag_query(q):
+        start = time.perf_counter()
+        answer = rag_chain.run(q)
+        get_context_stats().record_answer(time.perf_counter() - start)
+        return answer
 
     tools = [
         # RAG QUERY SYSTEM
         StructuredTool.from_function(
             name="rag_query",
-            func=lambda q: rag_chain.run(q),
+            func=rag_query,
             description="Answers questions about uploaded invoices and checks using retrieved document data"
         ),
 
@@ -166,3 +243,38 @@ def get_combined_agent(vectorstore, df_main, df_items) -> AgentExecutor:
     )
 
     return agent
+
+
+def question_terms(query, vendors=()):
+    """
+    What two questions must share before one reuses the other's cached answer, whatever
+    their embedding similarity: numbers and identifiers, quoted text, month names and the
+    rule-based filters (vendor, dates, document type, amounts).
+    """
+    numbers = {term.strip(".").lstrip("#").lower() for term in _KEY_TERM.findall(query)}
+    quoted = {text.strip().lower() for text in _QUOTED_TERM.findall(query)}
+    months = {word for word in re.findall(r"[a-z]+", query.lower()) if word in MONTHS}
+    filters = json.dumps(rule_filters(query, vendors), sort_keys=True)
+    return tuple(sorted(numbers)), tuple(sorted(quoted)), tuple(sorted(months)), filters
+
+
+def answer_query(agent, vectorstore, query, callbacks=None):
+    """
+    Run the agent on a user question, reusing a cached answer for the same or a
+    near-identical question (same identifiers, dates and amounts) asked against the same
+    invoice data. Failed runs ("Agent stopped ...") are not cached.
+    """
+    if not (LLM_CACHE_ENABLED and LLM_SEMANTIC_CACHE):
+        return agent.run(query, callbacks=callbacks)
+
+    cache = get_response_cache()
+    version = data_version(vectorstore)
+    terms = question_terms(query, get_hybrid_index(vectorstore).vendor_names())
+    vector = vectorstore.embeddings.embed_query(query.strip().lower())
+    answer = cache.get_similar(query, vector, version, terms)
+    if answer is not None:
+        return answer
+    answer = agent.run(query, callbacks=callbacks)
+    if answer and not answer.startswith(_FAILED_ANSWERS):
+        cache.put_similar(query, vector, version, answer, terms)
+    return answer
@@ -1,30 +1,314 @@
 # modules/llm_provider.py
 
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from langchain.llms.base import LLM
-from typing import Optional, List, Mapping, Any
-import requests
-from config import OLLAMA_BASE_URL, OLLAMA_MODEL
+from langchain.schema import Generation, LLMResult
+from langchain.schema.output import GenerationChunk
+from typing import Optional, List, Mapping, Any, Iterator, AsyncIterator, Callable
+from config import (
+    OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_MAX_CONCURRENCY,
+    LLM_CACHE_ENABLED, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL, LLM_SEMANTIC_THRESHOLD, SINGLE_FLIGHT_ENABLED
+)
+from modules.ollama_client import get_session, get_async_session, get_router, apost_json, open_stream, TIMEOUT
+from modules.scheduler import get_scheduler
+from modules.singleflight import get_single_flight
+from modules.telemetry import record_call
+
+
+class ResponseCache:
+    """
+    In-memory LLM answer cache with TTL and LRU eviction.
+
+    The exact level is keyed on (model, prompt, options, data version). The semantic
+    level stores question embeddings and returns a cached answer for a new question whose
+    cosine similarity to a cached one (same data version and same key terms: identifiers,
+    dates, amounts) reaches `threshold`. Passing the invoice data version in every key
+    means answers go stale as soon as documents change.
+    """
+
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL, threshold=LLM_SEMANTIC_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._exact = OrderedDict()     # key -> (answer, expires)
+        self._semantic = OrderedDict()  # (version, question) -> (unit vector, answer, expires, key terms)
+        self._lock = threading.Lock()
+        self.counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _put(self, table, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._exact.get(key)
+            if entry is not None and entry[1] < time.time():
+                del self._exact[key]
+                self.counters["expired"] += 1
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._exact.move_to_end(key)
+            self.counters["exact_hits"] += 1
+            return entry[0]
+
+    def put(self, key, answer):
+        with self._lock:
+            self._put(self._exact, key, (answer, time.time() + self.ttl))
+
+    def get_similar(self, question, vector, version, terms=()):
+        """
+        Answer cached for the most similar question under the same data version, or None.
+        Only questions with the same key `terms` qualify: "invoice #123" and "#124" embed
+        almost identically but must not share an answer.
+        """
+        vector = _unit(vector)
+        now = time.time()
+        best, best_score = None, self.threshold
+        with self._lock:
+            for key, (cached_vector, answer, expires, cached_terms) in list(self._semantic.items()):
+                if expires < now:
+                    del self._semantic[key]
+                    self.counters["expired"] += 1
+                    continue
+                if key[0] != version or cached_terms != terms:
+                    continue
+                score = sum(a * b for a, b in zip(vector, cached_vector))
+                if score >= best_score:
+                    best, best_score = key, score
+            if best is None:
+                self.counters["misses"] += 1
+                return None
+            self._semantic.move_to_end(best)
+            self.counters["semantic_hits"] += 1
+            return self._semantic[best][1]
+
+    def put_similar(self, question, vector, version, answer, terms=()):
+        with self._lock:
+            self._put(self._semantic, (version, question), (_unit(vector), answer, time.time() + self.ttl, terms))
+
+    def clear(self):
+        with self._lock:
+            self._exact.clear()
+            self._semantic.clear()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            counters["entries"] = len(self._exact) + len(self._semantic)
+        hits = counters["exact_hits"] + counters["semantic_hits"]
+        lookups = hits + counters["misses"]
+        counters["hit_rate"] = round(hits / lookups, 3) if lookups else 0.0
+        return counters
+
+
+def _unit(vector):
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+_response_cache = ResponseCache()
+
+
+def get_response_cache():
+    """The process-wide response cache shared by all OllamaLLM instances and sessions."""
+    return _response_cache
 
 
 class OllamaLLM(LLM):
     model: str = OLLAMA_MODEL
     base_url: str = OLLAMA_BASE_URL
+    keep_alive: str = OLLAMA_KEEP_ALIVE
+    max_concurrency: int = OLLAMA_MAX_CONCURRENCY
+    # When True, _call reads Ollama's token stream and reports each token to the callbacks
+    streaming: bool = False
+    # Tag for the telemetry records of this instance ("agent", "rag", "tool", ...)
+    call_site: str = "agent"
+    # Scheduler class of this instance's calls ("interactive" or "batch")
+    priority: str = "interactive"
+    # Exact-match answer cache; `data_version` returns the current invoice data version
+    use_response_cache: bool = LLM_CACHE_ENABLED
+    data_version: Optional[Callable[[], str]] = None
 
-    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
-        payload = {
+    def _cache_key(self, prompt: str, stop: Optional[List[str]]) -> str:
+        payload = self._payload(prompt, stop)
+        version = self.data_version() if self.data_version else None
+        return ResponseCache.make_key(payload["model"], payload["prompt"], payload["options"], version)
+
+    def _payload(self, prompt: str, stop: Optional[List[str]] = None) -> dict:
+        options = {"max_tokens": 4096}
+        if stop:
+            options["stop"] = stop
+        return {
             "model": self.model,
             "prompt": prompt,
             "stream": False,
-            "options": {
-                "max_tokens": 4096
-            }
+            "keep_alive": self.keep_alive,
+            "options": options
         }
-        response = requests.post(
-            f"{self.base_url}/api/generate",
-            json=payload
-        )
-        response.raise_for_status()
-        return response.json()["response"].strip()
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        if not self.use_response_cache and not SINGLE_FLIGHT_ENABLED:
+            return self._call_uncached(prompt, stop, run_manager, **kwargs)
+        key = self._cache_key(prompt, stop)
+        if self.use_response_cache:
+            cached = _response_cache.get(key)
+            if cached is not None:
+                if run_manager:
+                    run_manager.on_llm_new_token(cached)
+                return cached
+        if SINGLE_FLIGHT_ENABLED:
+            # The same prompt already being generated (e.g. two users asking at once) is awaited, not re-run
+            text, shared = get_single_flight("llm").do(
+                key, lambda: self._call_uncached(prompt, stop, run_manager, **kwargs)
+            )
+            if shared and run_manager:
+                run_manager.on_llm_new_token(text)
+        else:
+            text = self._call_uncached(prompt, stop, run_manager, **kwargs)
+        if self.use_response_cache:
+            _response_cache.put(key, text)
+        return text
+
+    def _call_uncached(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        if self.streaming:
+            return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs)).strip()
+        payload = self._payload(prompt, stop)
+
+        def send(url):
+            response = get_session().post(f"{url}/api/generate", json=payload, timeout=TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+
+        start = time.perf_counter()
+        with get_scheduler().slot(self.priority, self.model) as ticket:
+            url, data = get_router(self.base_url).request(self.model, send)
+        record_call(self.call_site, self.model, data, time.perf_counter() - start, endpoint=url,
+                    queue_wait_s=ticket.wait_s)
+        return data["response"].strip()
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        if not self.use_response_cache:
+            return await self._acall_uncached(prompt, stop, run_manager, **kwargs)
+        key = self._cache_key(prompt, stop)
+        cached = _response_cache.get(key)
+        if cached is not None:
+            if run_manager:
+                await run_manager.on_llm_new_token(cached)
+            return cached
+        text = await self._acall_uncached(prompt, stop, run_manager, **kwargs)
+        _response_cache.put(key, text)
+        return text
+
+    async def _acall_uncached(self, prompt: str, stop: Optional[List[str]] = None,
+                              run_manager=None, **kwargs: Any) -> str:
+        if self.streaming:
+            chunks = [chunk.text async for chunk in self._astream(prompt, stop, run_manager, **kwargs)]
+            return "".join(chunks).strip()
+        start = time.perf_counter()
+        payload = self._payload(prompt, stop)
+        async with get_scheduler().aslot(self.priority, self.model) as ticket:
+            url, data = await get_router(self.base_url).arequest(
+                self.model, lambda url: apost_json(f"{url}/api/generate", payload)
+            )
+        record_call(self.call_site, self.model, data, time.perf_counter() - start, endpoint=url,
+                    queue_wait_s=ticket.wait_s)
+        return data["response"].strip()
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        payload = {**self._payload(prompt, stop), "stream": True}
+        start = time.perf_counter()
+        first_token_s = None
+        with get_scheduler().slot(self.priority, self.model) as ticket, \
+                get_router(self.base_url).connect(
+                    self.model, lambda url: open_stream(get_session(), f"{url}/api/generate", payload)
+                ) as (url, response), response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                chunk = GenerationChunk(text=data.get("response", ""))
+                if chunk.text and first_token_s is None:
+                    first_token_s = time.perf_counter() - start
+                if run_manager and chunk.text:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                if data.get("done"):
+                    record_call(self.call_site, self.model, data, time.perf_counter() - start,
+                                streamed=True, first_token_s=first_token_s, endpoint=url,
+                                queue_wait_s=ticket.wait_s)
+                yield chunk
+                if data.get("done"):
+                    break
+
+    async def _astream(self, prompt: str, stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[GenerationChunk]:
+        payload = {**self._payload(prompt, stop), "stream": True}
+        start = time.perf_counter()
+        first_token_s = None
+        async def open_astream(url):
+            response = await get_async_session().post(f"{url}/api/generate", json=payload)
+            if not response.ok:
+                response.release()
+                response.raise_for_status()
+            return response
+
+        async with get_scheduler().aslot(self.priority, self.model) as ticket:
+            async with get_router(self.base_url).aconnect(self.model, open_astream) as (url, response):
+                async with response:
+                    async for line in response.content:
+                        if not line.strip():
+                            continue
+                        data = json.loads(line)
+                        chunk = GenerationChunk(text=data.get("response", ""))
+                        if chunk.text and first_token_s is None:
+                            first_token_s = time.perf_counter() - start
+                        if run_manager and chunk.text:
+                            await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                        if data.get("done"):
+                            record_call(self.call_site, self.model, data, time.perf_counter() - start,
+                                        streamed=True, first_token_s=first_token_s, endpoint=url,
+                                        queue_wait_s=ticket.wait_s)
+                        yield chunk
+                        if data.get("done"):
+                            break
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> LLMResult:
+        # Several prompts (llm.batch / generate) are sent concurrently over the pooled session
+        if len(prompts) == 1:
+            texts = [self._call(prompts[0], stop=stop, run_manager=run_manager, **kwargs)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(prompts), self.max_concurrency)) as pool:
+                texts = list(pool.map(
+                    lambda p: self._call(p, stop=stop, run_manager=run_manager, **kwargs), prompts
+                ))
+        return LLMResult(generations=[[Generation(text=text)] for text in texts])
+
+    async def _agenerate(self, prompts: List[str], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> LLMResult:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def one(prompt):
+            async with semaphore:
+                return await self._acall(prompt, stop=stop, run_manager=run_manager, **kwargs)
+
+        texts = await asyncio.gather(*(one(p) for p in prompts))
+        return LLMResult(generations=[[Generation(text=text)] for text in texts])
 
     @property
     def _identifying_params(self) -> Mapping[str, Any]:
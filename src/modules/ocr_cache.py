@@ -0,0 +1,156 @@
+# modules/ocr_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from config import OCR_CACHE_PATH, OCR_CACHE_MAX_BYTES
+
+
+def sha256_hex(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class OCRCache:
+    """
+    Persistent, content-addressed cache of parsed OCR results.
+
+    Entries are keyed by (image SHA-256, OCR model, prompt hash) and stored in SQLite.
+    When the total payload size exceeds `max_bytes`, the least recently used entries
+    are evicted. Hit/miss counters are kept per process.
+    """
+
+    def __init__(self, path=OCR_CACHE_PATH, max_bytes=OCR_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS ocr_cache (
+                image_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (image_hash, model, prompt_hash)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_lru ON ocr_cache(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(image_bytes, model, prompt):
+        return sha256_hex(image_bytes), model, sha256_hex(prompt)
+
+    def get(self, key):
+        """Return the cached result dict for `key`, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM ocr_cache WHERE image_hash=? AND model=? AND prompt_hash=?", key
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE ocr_cache SET last_access=? WHERE image_hash=? AND model=? AND prompt_hash=?",
+                (time.time(), *key)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        payload = json.dumps(result, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, payload, len(payload), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT image_hash, model, prompt_hash, size FROM ocr_cache ORDER BY last_access"
+        ).fetchall()
+        for image_hash, model, prompt_hash, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute(
+                "DELETE FROM ocr_cache WHERE image_hash=? AND model=? AND prompt_hash=?",
+                (image_hash, model, prompt_hash)
+            )
+            total -= size
+
+    def invalidate(self, model=None, keep_model=None):
+        """
+        Drop cached results. `model` removes entries produced by that model tag,
+        `keep_model` removes everything produced by any other model, and with
+        neither argument the whole cache is cleared. Returns the number of rows deleted.
+        """
+        with self._lock:
+            if model is not None:
+                cur = self._conn.execute("DELETE FROM ocr_cache WHERE model=?", (model,))
+            elif keep_model is not None:
+                cur = self._conn.execute("DELETE FROM ocr_cache WHERE model!=?", (keep_model,))
+            else:
+                cur = self._conn.execute("DELETE FROM ocr_cache")
+            self._conn.commit()
+        return cur.rowcount
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache():
+    """Return the process-wide OCR cache (opened on first use)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = OCRCache()
+    return _cache
+
+
+if __name__ == "__main__":
+    # python -m modules.ocr_cache [stats | clear | drop-model <tag> | keep-model <tag>]
+    import sys
+
+    cache = get_ocr_cache()
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if cmd == "clear":
+        print(f"Removed {cache.invalidate()} entries.")
+    elif cmd == "drop-model":
+        print(f"Removed {cache.invalidate(model=sys.argv[2])} entries.")
+    elif cmd == "keep-model":
+        print(f"Removed {cache.invalidate(keep_model=sys.argv[2])} entries.")
+    else:
+        print(cache.stats())
@@ -1,10 +1,23 @@
 import base64
+import copy
 import json
-import requests
-from PIL import Image
+from PIL import Image, ImageChops, ImageOps
 from io import BytesIO
 import re
-from config import OLLAMA_BASE_URL, OLLAMA_OCR_MODEL
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from config import (
+    OLLAMA_BASE_URL, OLLAMA_OCR_MODEL, OCR_CACHE_ENABLED, OCR_PREPROCESS, OCR_STRUCTURED_OUTPUT,
+    OCR_MAX_WORKERS, OCR_PDF_DPI, OCR_TILING, OCR_CASCADE, OLLAMA_OCR_FAST_MODEL, OCR_REQUIRED_FIELDS,
+    OCR_AMOUNT_TOLERANCE, OLLAMA_KEEP_ALIVE, SINGLE_FLIGHT_ENABLED
+)
+from modules.ollama_client import get_session, get_router, open_stream, TIMEOUT
+from modules.ocr_cache import OCRCache, get_ocr_cache
+from modules.scheduler import get_scheduler, with_current_priority, QueueFullError
+from modules.singleflight import get_single_flight
+from modules.telemetry import record_call
 
 # Instruction prompt for structured invoice/receipt extraction
 instruction = (
@@ -83,19 +96,255 @@ instruction = (
 
 def image_to_base64(image_path):
     with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode("utf-8")
+        return bytes_to_base64(img_file.read())
+
+
+def bytes_to_base64(image_bytes):
+    return base64.b64encode(image_bytes).decode("utf-8")
+
+
+def autocrop(img, tolerance=12, margin=16):
+    """Trim background margins whose colour matches the top-left corner pixel."""
+    gray = img.convert("L")
+    background = Image.new("L", gray.size, gray.getpixel((0, 0)))
+    diff = ImageChops.difference(gray, background).point(lambda p: 255 if p > tolerance else 0)
+    bbox = diff.getbbox()
+    if not bbox:
+        return img
+    left, top, right, bottom = bbox
+    return img.crop((
+        max(left - margin, 0),
+        max(top - margin, 0),
+        min(right + margin, img.width),
+        min(bottom + margin, img.height),
+    ))
+
+
+def downscale(img, max_edge=None, max_pixels=None):
+    """Shrink the image to fit a longest-edge limit and/or a total pixel budget."""
+    scale = 1.0
+    if max_edge:
+        scale = min(scale, max_edge / max(img.size))
+    if max_pixels:
+        scale = min(scale, (max_pixels / (img.width * img.height)) ** 0.5)
+    if scale >= 1.0:
+        return img
+    size = (max(int(img.width * scale), 1), max(int(img.height * scale), 1))
+    return img.resize(size, Image.LANCZOS)
+
+
+def preprocess_image(image_bytes, options=OCR_PREPROCESS, label=""):
+    """
+    Shrink an image before it is base64-encoded for the VLM.
+
+    Applies EXIF orientation, optional margin crop, downscaling, grayscale/binarization
+    and re-encodes as JPEG or WebP. The original bytes are returned if preprocessing is
+    disabled or would not make the payload smaller.
+    """
+    if not options or not options.get("enabled", True):
+        return image_bytes
+
+    img = ImageOps.exif_transpose(Image.open(BytesIO(image_bytes)))
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    if options.get("autocrop"):
+        img = autocrop(img)
+    img = downscale(img, options.get("max_edge"), options.get("max_pixels"))
+    if options.get("grayscale") or options.get("binarize") is not None:
+        img = img.convert("L")
+    if options.get("binarize") is not None:
+        threshold = options["binarize"]
+        img = img.point(lambda p: 255 if p > threshold else 0)
+
+    fmt = options.get("format", "JPEG").upper()
+    out = BytesIO()
+    img.save(out, format=fmt, quality=options.get("quality", 85))
+    processed = out.getvalue()
+
+    before, after = len(image_bytes), len(processed)
+    if after >= before:
+        print(f"[OCR] preprocess {label}: kept original ({before} bytes)")
+        return image_bytes
+    print(f"[OCR] preprocess {label}: {before} -> {after} bytes "
+          f"(saved {before - after}, {100 * (before - after) / before:.0f}%)")
+    return processed
+
+
+# JSON schema passed as Ollama's `format` (mirrors the output format in `instruction`)
+_STRING_FIELDS = [
+    "invoice_number", "check_number", "po_number", "vendor", "vendor_address",
+    "customer_name", "customer_address", "date", "due_date", "payment_date",
+    "amount", "subtotal", "tax", "VAT", "discount", "total", "currency",
+    "payment_method", "account_number", "routing_number", "bank_name",
+    "document_type", "notes",
+]
+INVOICE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **{name: {"type": "string"} for name in _STRING_FIELDS},
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {name: {"type": "string"} for name in ["item", "qty", "price", "total"]},
+                "required": ["item", "qty", "price", "total"],
+            },
+        },
+    },
+    "required": _STRING_FIELDS + ["items"],
+}
+
+# How often each extract_json path fires: "fenced", "raw", "recovered", "failed"
+_parse_stats = Counter()
+_parse_stats_lock = threading.Lock()
+
+
+def _count(path):
+    with _parse_stats_lock:
+        _parse_stats[path] += 1
+
+
+def parse_stats():
+    """Snapshot of the JSON extraction path counters for this process."""
+    with _parse_stats_lock:
+        return dict(_parse_stats)
+
+
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def recover_json(text):
+    """
+    Best-effort, single-pass repair of truncated or slightly malformed JSON.
+
+    Handles leading/trailing chatter, trailing commas, single-quoted strings, raw newlines
+    in strings, Python literals and output cut off mid-object (everything after the last
+    complete value is dropped and open brackets are closed). Returns a dict or None.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    out = []
+    stack = []           # open brackets, each entry is [closer, expecting_key]
+    quote = None         # active string delimiter
+    escape = False
+    literal = []         # pending number / true / false / null token
+    safe = None          # (len(out), closers) after the last complete value
+
+    def mark_safe():
+        nonlocal safe
+        safe = (len(out), [entry[0] for entry in stack])
+
+    def flush_literal():
+        if literal:
+            token = "".join(literal)
+            out.append(_PY_LITERALS.get(token, token))
+            literal.clear()
+            mark_safe()
+
+    def drop_trailing_comma():
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1] == ",":
+            out.pop()
+
+    for ch in text[start:]:
+        if quote:
+            if escape:
+                if ch == "'":
+                    out[-1] = ch  # \' is not a valid JSON escape
+                else:
+                    out.append(ch)
+                escape = False
+            elif ch == "\\":
+                out.append(ch)
+                escape = True
+            elif ch == quote:
+                out.append('"')
+                quote = None
+                if not (stack and stack[-1][0] == "}" and stack[-1][1]):
+                    mark_safe()
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+            continue
+
+        if ch.isalnum() or ch in "+-.":
+            literal.append(ch)
+            continue
+        flush_literal()
+
+        if ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append(["}" if ch == "{" else "]", ch == "{"])
+            out.append(ch)
+        elif ch in "}]":
+            drop_trailing_comma()
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                return _loads_or_none("".join(out))
+            mark_safe()
+        elif ch == ":":
+            if stack:
+                stack[-1][1] = False
+            out.append(ch)
+        elif ch == ",":
+            if stack and stack[-1][0] == "}":
+                stack[-1][1] = True
+            out.append(ch)
+        elif ch.isspace():
+            out.append(ch)
+
+    # Truncated: keep everything up to the last complete value and close what is open
+    if quote and not escape and not (stack and stack[-1][0] == "}" and stack[-1][1]):
+        out.append('"')
+        mark_safe()
+    elif literal and re.fullmatch(r"-?\d+(\.\d+)?|true|false|null|True|False|None", "".join(literal)):
+        flush_literal()
+    if safe is None:
+        return None
+    length, closers = safe
+    del out[length:]
+    drop_trailing_comma()
+    return _loads_or_none("".join(out) + "".join(reversed(closers)))
+
+
+def _loads_or_none(text):
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
 
 
 def extract_json(text):
-    """Extract JSON code block from markdown-style ```json``` or loose text."""
+    """
+    Extract a JSON object string from model output.
+
+    Tries a markdown-style ```json``` block, then the raw text, then `recover_json`;
+    falls back to "{}". Each path is counted in `parse_stats()`.
+    """
     match = re.search(r"```json\s*(\{.*?\})\s*```", text, re.DOTALL)
-    if match:
+    if match and _loads_or_none(match.group(1)) is not None:
+        _count("fenced")
         return match.group(1)
-    try:
-        # fallback if no code block wrapper
-        return json.loads(text)
-    except json.JSONDecodeError:
-        return "{}"
+    if _loads_or_none(text.strip()) is not None:
+        _count("raw")
+        return text.strip()
+    recovered = recover_json(text)
+    if recovered is not None:
+        _count("recovered")
+        return json.dumps(recovered, ensure_ascii=False)
+    _count("failed")
+    return "{}"
 
 
 def normalize_fields(data):
@@ -128,25 +377,221 @@ def normalize_fields(data):
     return data
 
 
-def parse_image(image_path):
-    """Send the image to Ollama and return structured, cleaned data."""
-    image_b64 = image_to_base64(image_path)
+class JSONObjectStream:
+    """
+    Incremental scanner for the first top-level JSON object in a token stream.
+
+    Text before the opening brace (e.g. a ```json fence) is skipped. `feed` returns the
+    top-level (key, value) pairs completed by each chunk, and `done` flips once the
+    object's closing brace arrives, so the caller can stop reading the stream.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.start = -1
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.key = None
+        self.key_start = -1
+        self.value_start = -1
+        self.done = False
+        self.fields = {}
+
+    def feed(self, chunk):
+        completed = []
+        self.text += chunk
+        while self.pos < len(self.text) and not self.done:
+            i, ch = self.pos, self.text[self.pos]
+            self.pos += 1
+            if self.start < 0:
+                if ch == "{":
+                    self.start, self.depth = i, 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1 and self.key is None and self.key_start >= 0:
+                        self.key = json.loads(self.text[self.key_start:i + 1])
+                continue
+            if ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self.key is None:
+                    self.key_start = i
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._finish_value(i, completed)
+                    self.done = True
+            elif ch == ":" and self.depth == 1 and self.key is not None and self.value_start < 0:
+                self.value_start = i + 1
+            elif ch == "," and self.depth == 1:
+                self._finish_value(i, completed)
+        return completed
+
+    def _finish_value(self, end, completed):
+        if self.key is not None and self.value_start >= 0:
+            raw = self.text[self.value_start:end].strip()
+            try:
+                value = json.loads(raw)
+            except ValueError:
+                value = raw
+            self.fields[self.key] = value
+            completed.append((self.key, value))
+        self.key, self.key_start, self.value_start = None, -1, -1
+
+    @property
+    def object_text(self):
+        return self.text[self.start:self.pos] if self.start >= 0 else ""
+
+
+# Chunks read after the JSON object closed while waiting for Ollama's final "done" chunk
+STREAM_TAIL_CHUNKS = 3
+
+
+def _generate(session, base_url, payload):
+    def send(url):
+        response = session.post(f"{url}/api/generate", json=payload, timeout=TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    start = time.perf_counter()
+    with get_scheduler().slot(key=payload["model"]) as ticket:
+        url, data = get_router(base_url).request(payload["model"], send)
+    record_call("ocr", payload["model"], data, time.perf_counter() - start, endpoint=url,
+                queue_wait_s=ticket.wait_s)
+    return data["response"]
+
+
+def _generate_stream(session, base_url, payload, on_field=None):
+    """
+    Consume Ollama's NDJSON token stream and stop as soon as the top-level JSON object
+    closes. `on_field(key, value, elapsed_s)` fires for every completed top-level field.
+    """
+    start = time.perf_counter()
+    first_field_s = None
+    chunks = 0
+    tail = 0
+    chunk = {}
+    scanner = JSONObjectStream()
+    with get_scheduler().slot(key=payload["model"]) as ticket, \
+            get_router(base_url).connect(
+                payload["model"], lambda url: open_stream(session, f"{url}/api/generate", {**payload, "stream": True})
+            ) as (url, response), response:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            chunks += 1
+            for key, value in scanner.feed(chunk.get("response", "")):
+                if first_field_s is None:
+                    first_field_s = time.perf_counter() - start
+                if on_field:
+                    on_field(key, value, time.perf_counter() - start)
+            if chunk.get("done"):
+                break
+            if scanner.done:
+                # The final chunk (with the timing fields) usually follows right after the
+                # closing brace; read a few more lines for it before cutting the stream
+                tail += 1
+                if tail > STREAM_TAIL_CHUNKS:
+                    break
+    # Leaving the block closes the connection, which makes Ollama stop generating.
+    # Timing fields only arrive with the final chunk; a cut stream records the chunk count instead.
+    stats = chunk if chunk.get("done") else {"eval_count": chunks}
+    record_call("ocr", payload["model"], stats, time.perf_counter() - start,
+                streamed=True, truncated=not chunk.get("done"), first_field_s=first_field_s, endpoint=url,
+                queue_wait_s=ticket.wait_s)
+    return scanner.object_text if scanner.done else scanner.text
+
+
+def parse_image(image_path, session=None, base_url=OLLAMA_BASE_URL, use_cache=OCR_CACHE_ENABLED,
+                preprocess=OCR_PREPROCESS, stream=False, on_field=None, model=OLLAMA_OCR_MODEL):
+    """Send the image to Ollama and return structured, cleaned data.
+
+    `session` lets bulk callers share one pooled HTTP session; by default the
+    process-wide session from `ollama_client` is used. Results are served from the
+    on-disk OCR cache when the same image was already parsed with the same model and prompt.
+    `preprocess` holds the image preprocessing options (see `config.OCR_PREPROCESS`).
+    With `stream=True` the output is read token by token, `on_field(key, value, elapsed_s)`
+    is called as each top-level field completes, and the request is cut once the JSON closes.
+    """
+    with open(image_path, "rb") as img_file:
+        image_bytes = img_file.read()
+    return parse_image_bytes(image_bytes, image_path, session=session, base_url=base_url, use_cache=use_cache,
+                             preprocess=preprocess, stream=stream, on_field=on_field, model=model)
+
+
+def parse_image_bytes(image_bytes, label, session=None, base_url=OLLAMA_BASE_URL, use_cache=OCR_CACHE_ENABLED,
+                      preprocess=OCR_PREPROCESS, stream=False, on_field=None, model=OLLAMA_OCR_MODEL):
+    """Same as `parse_image` for in-memory image bytes; `label` names the source in logs and `text`."""
+    start = time.perf_counter()
+    variant = json.dumps(preprocess, sort_keys=True) if preprocess and preprocess.get("enabled", True) else ""
+    if OCR_STRUCTURED_OUTPUT:
+        variant += json.dumps(INVOICE_SCHEMA, sort_keys=True)
+    cache_key = OCRCache.make_key(image_bytes, model, instruction + variant)
+    if use_cache:
+        cached = get_ocr_cache().get(cache_key)
+        if cached is not None:
+            cached["text"] = f"OCR performed on: {label}"
+            if on_field:
+                for key, value in cached.items():
+                    on_field(key, value, time.perf_counter() - start)
+            return cached
+
+    def run():
+        return _parse_image_uncached(image_bytes, label, session, base_url, preprocess, stream, on_field,
+                                     model, cache_key if use_cache else None)
+
+    if not SINGLE_FLIGHT_ENABLED:
+        return run()
+    # Identical concurrent uploads share one generation; every caller gets its own copy
+    fields, shared = get_single_flight("ocr").do(cache_key, run)
+    fields = copy.deepcopy(fields)
+    if shared and fields:
+        fields["text"] = f"OCR performed on: {label}"
+        if on_field:
+            for key, value in fields.items():
+                on_field(key, value, time.perf_counter() - start)
+    return fields
+
+
+def _parse_image_uncached(image_bytes, label, session, base_url, preprocess, stream, on_field, model, cache_key):
+    session = session or get_session()
+    try:
+        image_bytes = preprocess_image(image_bytes, preprocess, label=label)
+    except OSError as e:
+        print(f"[WARN] Preprocessing failed for {label}, sending original: {e}")
+    image_b64 = bytes_to_base64(image_bytes)
 
     payload = {
-        "model": OLLAMA_OCR_MODEL,
+        "model": model,
         "prompt": instruction,
         "images": [image_b64],
-        "stream": False
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE
     }
+    if OCR_STRUCTURED_OUTPUT:
+        payload["format"] = INVOICE_SCHEMA
 
     try:
-        response = requests.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload)
-        response.raise_for_status()
-        raw_output = response.json()["response"]
+        if stream:
+            raw_output = _generate_stream(session, base_url, payload, on_field)
+        else:
+            raw_output = _generate(session, base_url, payload)
         print(raw_output)
         json_str = extract_json(raw_output)
         parsed_json = json.loads(json_str)
         parsed = normalize_fields(parsed_json)
+    except QueueFullError:
+        raise  # Rejected by the scheduler: the caller should retry later, not record "no data"
     except Exception as e:
         print(f"[ERROR] Failed to parse image: {e}")
         return {}
@@ -177,7 +622,7 @@ def parse_image(image_path):
         "items": [],
         "document_type": "",
         "notes": "",
-        "text": f"OCR performed on: {image_path}"
+        "text": f"OCR performed on: {label}"
     }
 
     # Overwrite fields with parsed result if present
@@ -185,4 +630,269 @@ def parse_image(image_path):
         if key in parsed:
             fields[key] = parsed[key]
 
+    if cache_key:
+        get_ocr_cache().put(cache_key, fields)
+
     return fields
+
+
+# --- PDF documents -----------------------------------------------------------
+
+HEADER_FIELDS = [
+    "invoice_number", "check_number", "po_number", "vendor", "vendor_address",
+    "customer_name", "customer_address", "date", "due_date", "payment_date",
+    "currency", "payment_method", "account_number", "routing_number", "bank_name",
+    "document_type",
+]
+TOTAL_FIELDS = ["amount", "subtotal", "tax", "discount", "total"]
+
+
+def iter_pdf_pages(pdf_path, dpi=OCR_PDF_DPI):
+    """Yield (page_number, JPEG bytes) one page at a time, so only one bitmap is ever in memory."""
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            img = page.render(scale=dpi / 72).to_pil()
+            page.close()
+            out = BytesIO()
+            img.convert("RGB").save(out, format="JPEG", quality=90)
+            yield index + 1, out.getvalue()
+    finally:
+        pdf.close()
+
+
+def _item_key(item):
+    if not isinstance(item, dict):
+        return json.dumps(item, sort_keys=True, default=str)
+    name = re.sub(r"[^a-z0-9]", "", str(item.get("item", "")).lower())
+    return name, str(item.get("qty", "")), str(item.get("total", ""))
+
+
+def append_without_overlap(items, new_items):
+    """
+    Append `new_items` to `items`, dropping the leading rows that repeat the tail of
+    `items` (rows read twice in the overlap between two neighbouring strips).
+    """
+    keys = [_item_key(i) for i in items]
+    new_keys = [_item_key(i) for i in new_items]
+    for size in range(min(len(keys), len(new_keys)), 0, -1):
+        if keys[-size:] == new_keys[:size]:
+            return items + new_items[size:]
+    return items + new_items
+
+
+def merge_page_results(pages, label="", dedupe_overlap=False):
+    """
+    Merge per-page OCR results (in page order) into one invoice record.
+
+    Line items are concatenated, header fields come from the first page that has them,
+    and totals come from the summary page, i.e. the last page with a non-empty total.
+    With `dedupe_overlap`, rows repeated at the seam between consecutive parts are dropped.
+    """
+    pages = [p for p in pages if p]
+    if not pages:
+        return {}
+    merged = dict(pages[0])
+
+    for key in HEADER_FIELDS:
+        merged[key] = next((p[key] for p in pages if p.get(key) not in ("", None)), "")
+
+    summary = next((p for p in reversed(pages) if p.get("total") not in ("", None)), pages[-1])
+    for key in TOTAL_FIELDS:
+        merged[key] = summary.get(key, "")
+        if merged[key] in ("", None):
+            merged[key] = next((p[key] for p in pages if p.get(key) not in ("", None)), "")
+
+    merged["items"] = []
+    for p in pages:
+        if dedupe_overlap:
+            merged["items"] = append_without_overlap(merged["items"], p.get("items", []))
+        else:
+            merged["items"].extend(p.get("items", []))
+    notes = []
+    for p in pages:
+        if p.get("notes") and p["notes"] not in notes:
+            notes.append(p["notes"])
+    merged["notes"] = " ".join(notes)
+    merged["text"] = f"OCR performed on: {label} ({len(pages)} pages)"
+    return merged
+
+
+def parse_pdf(pdf_path, dpi=OCR_PDF_DPI, max_workers=OCR_MAX_WORKERS, session=None,
+              base_url=OLLAMA_BASE_URL, use_cache=OCR_CACHE_ENABLED, model=OLLAMA_OCR_MODEL):
+    """
+    OCR a (multi-page) PDF and return one merged invoice record.
+
+    Pages are rasterized lazily on the calling thread and OCR'd on a thread pool, with
+    at most `max_workers` rendered pages waiting at any time, so memory stays flat for
+    long statements.
+    """
+    session = session or get_session()
+    pages = iter_pdf_pages(pdf_path, dpi)
+    results = {}
+    parse_page = with_current_priority(parse_image_bytes)  # Pages of an upload stay interactive
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_workers:
+                try:
+                    number, image_bytes = next(pages)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = pool.submit(parse_page, image_bytes, f"{pdf_path}#page={number}",
+                                     session=session, base_url=base_url, use_cache=use_cache, model=model)
+                pending[future] = number
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+
+    return merge_page_results([results[n] for n in sorted(results)], label=pdf_path)
+
+
+# --- Tall images --------------------------------------------------------------
+
+def needs_tiling(image_path, options=OCR_TILING):
+    """True if the image is tall enough to be OCR'd in strips (only the header is read)."""
+    if not options or not options.get("enabled", True):
+        return False
+    with Image.open(image_path) as img:
+        width, height = img.size
+        if img.getexif().get(0x0112) in (5, 6, 7, 8):  # EXIF orientation rotated by 90 degrees
+            width, height = height, width
+    return height / width > options.get("min_aspect", 2.5)
+
+
+def split_into_strips(image_bytes, options=OCR_TILING):
+    """Cut an image into overlapping horizontal strips and return them as JPEG bytes."""
+    img = ImageOps.exif_transpose(Image.open(BytesIO(image_bytes))).convert("RGB")
+    strip_height = max(int(img.width * options.get("strip_aspect", 1.4)), 1)
+    step = max(int(strip_height * (1 - options.get("overlap", 0.15))), 1)
+    strips = []
+    top = 0
+    while True:
+        bottom = min(top + strip_height, img.height)
+        out = BytesIO()
+        img.crop((0, top, img.width, bottom)).save(out, format="JPEG", quality=90)
+        strips.append(out.getvalue())
+        if bottom >= img.height:
+            return strips
+        top += step
+
+
+def parse_tall_image(image_path, options=OCR_TILING, max_workers=OCR_MAX_WORKERS, session=None,
+                     base_url=OLLAMA_BASE_URL, use_cache=OCR_CACHE_ENABLED, model=OLLAMA_OCR_MODEL):
+    """
+    OCR a very tall image (e.g. a long receipt) as overlapping strips in parallel.
+
+    Strip results are merged in order: header fields from the first strip, totals from
+    the last one, and line items concatenated with rows repeated in the overlaps removed.
+    """
+    with open(image_path, "rb") as img_file:
+        strips = split_into_strips(img_file.read(), options)
+    session = session or get_session()
+    parse_strip = with_current_priority(parse_image_bytes)  # Strips of an upload stay interactive
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(
+            lambda pair: parse_strip(pair[1], f"{image_path}#strip={pair[0]}", session=session,
+                                           base_url=base_url, use_cache=use_cache, model=model),
+            enumerate(strips, start=1),
+        ))
+    merged = merge_page_results(results, label=image_path, dedupe_overlap=True)
+    if merged:
+        merged["text"] = f"OCR performed on: {image_path} ({len(strips)} strips)"
+    return merged
+
+
+def _parse_single(path, **kwargs):
+    is_pdf = str(path).lower().endswith(".pdf")
+    if is_pdf or needs_tiling(path):
+        kwargs.pop("stream", None)
+        kwargs.pop("on_field", None)
+        return parse_pdf(path, **kwargs) if is_pdf else parse_tall_image(path, **kwargs)
+    kwargs.pop("max_workers", None)
+    return parse_image(path, **kwargs)
+
+
+# --- Model cascade -------------------------------------------------------------
+
+_cascade_stats = Counter()
+
+
+def cascade_stats():
+    """How many documents each cascade tier produced in this process ("fast", "full")."""
+    with _parse_stats_lock:
+        return dict(_cascade_stats)
+
+
+def _amount(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _close(a, b, tolerance=OCR_AMOUNT_TOLERANCE):
+    return abs(a - b) <= max(tolerance * max(abs(a), abs(b)), 0.01)
+
+
+def validate_invoice(parsed, required=OCR_REQUIRED_FIELDS, tolerance=OCR_AMOUNT_TOLERANCE):
+    """
+    Consistency checks on a parsed document; returns a list of problems (empty if it passes).
+
+    Checks that required fields are present, that line items sum to the subtotal and that
+    subtotal + tax - discount matches the total. Arithmetic checks are skipped when the
+    amounts they need were not extracted.
+    """
+    if not parsed:
+        return ["empty result"]
+    problems = [f"missing {key}" for key in required if parsed.get(key) in ("", None, [])]
+
+    subtotal = _amount(parsed.get("subtotal"))
+    if subtotal is None:
+        subtotal = _amount(parsed.get("amount"))
+    item_totals = [_amount(i.get("total")) for i in parsed.get("items", []) if isinstance(i, dict)]
+    if subtotal is not None and item_totals and None not in item_totals:
+        if not _close(sum(item_totals), subtotal, tolerance):
+            problems.append(f"items sum {sum(item_totals):.2f} != subtotal {subtotal:.2f}")
+
+    total = _amount(parsed.get("total"))
+    if subtotal is not None and total is not None:
+        expected = subtotal + (_amount(parsed.get("tax")) or 0) - abs(_amount(parsed.get("discount")) or 0)
+        if not _close(expected, total, tolerance):
+            problems.append(f"subtotal + tax - discount {expected:.2f} != total {total:.2f}")
+    return problems
+
+
+def parse_document(path, cascade=OCR_CASCADE, **kwargs):
+    """
+    Dispatch on the input: PDFs go to `parse_pdf`, very tall images to `parse_tall_image`
+    and everything else to `parse_image`.
+
+    With `cascade`, the document is first parsed with OLLAMA_OCR_FAST_MODEL and only
+    re-run on OLLAMA_OCR_MODEL when `validate_invoice` reports problems. The tier that
+    produced the result is recorded in the `ocr_tier` field.
+    """
+    if not cascade:
+        parsed = _parse_single(path, **kwargs)
+        tier = "full"
+    else:
+        parsed = _parse_single(path, model=OLLAMA_OCR_FAST_MODEL, **kwargs)
+        problems = validate_invoice(parsed)
+        tier = "fast"
+        if problems:
+            print(f"[OCR] {path}: escalating to {OLLAMA_OCR_MODEL} ({'; '.join(problems)})")
+            parsed = _parse_single(path, model=OLLAMA_OCR_MODEL, **kwargs)
+            tier = "full"
+    if parsed:
+        parsed["ocr_tier"] = tier
+        with _parse_stats_lock:
+            _cascade_stats[tier] += 1
+    return parsed
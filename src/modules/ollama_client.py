@@ -0,0 +1,374 @@
+# modules/ollama_client.py
+
+import asyncio
+import threading
+import time
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
+from config import (
+    OLLAMA_BASE_URL, OLLAMA_POOL_SIZE, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT,
+    OLLAMA_MAX_RETRIES, OLLAMA_RETRY_BACKOFF, OLLAMA_ENDPOINTS, OLLAMA_HEALTH_INTERVAL,
+    OLLAMA_EJECT_AFTER, OLLAMA_EJECT_SECONDS, OLLAMA_SPILL_OUTSTANDING
+)
+
+# (connect, read) timeout passed to every requests call
+TIMEOUT = (OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+RETRY_STATUSES = (502, 503, 504)
+# With several endpoints the router fails over on connection errors; retrying a dead one
+# with backoff first would only add seconds to every request until it is ejected
+CONNECT_RETRIES = 0 if len(OLLAMA_ENDPOINTS) > 1 else None  # None: up to max_retries
+
+_session = None
+_session_lock = threading.Lock()
+_async_sessions = weakref.WeakKeyDictionary()  # event loop -> aiohttp session
+
+
+def new_session(pool_size=OLLAMA_POOL_SIZE, max_retries=OLLAMA_MAX_RETRIES, connect_retries=CONNECT_RETRIES):
+    """Create a requests session with a connection pool sized for concurrent Ollama calls."""
+    session = requests.Session()
+    retry = Retry(
+        total=max_retries,
+        connect=connect_retries,
+        read=0,  # A timeout or drop after the POST was sent would re-run the whole generation
+        backoff_factor=OLLAMA_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,  # Ollama calls are POSTs; retry them too
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=max(4, len(OLLAMA_ENDPOINTS)), pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """Return the process-wide pooled session (created on first use)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = new_session()
+    return _session
+
+
+def get_async_session():
+    """Return a pooled aiohttp session bound to the running event loop."""
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=OLLAMA_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(sock_connect=OLLAMA_CONNECT_TIMEOUT, sock_read=OLLAMA_READ_TIMEOUT),
+        )
+        _async_sessions[loop] = session
+    return session
+
+
+async def aclose_async_session():
+    """Close the running loop's aiohttp session (call before the event loop shuts down)."""
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+async def apost_json(url, payload, max_retries=OLLAMA_MAX_RETRIES, connect_retries=CONNECT_RETRIES):
+    """
+    POST `payload` with the loop's pooled session and return the decoded JSON body. Only
+    connection failures (up to `connect_retries`) and 502/503/504 are retried; timeouts
+    and drops after the request was sent are not, since that would run the generation again.
+    """
+    session = get_async_session()
+    for attempt in range(max_retries + 1):
+        try:
+            async with session.post(url, json=payload) as response:
+                if response.status in RETRY_STATUSES and attempt < max_retries:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status
+                    )
+                response.raise_for_status()
+                return await response.json()
+        except (aiohttp.ClientConnectorError, aiohttp.ClientResponseError) as e:
+            status = getattr(e, "status", None)
+            if attempt >= max_retries or (status is not None and status not in RETRY_STATUSES):
+                raise
+            if status is None and connect_retries is not None and attempt >= connect_retries:
+                raise
+            await asyncio.sleep(OLLAMA_RETRY_BACKOFF * 2 ** attempt)
+
+
+# --- Multi-endpoint routing ---------------------------------------------------
+
+class Endpoint:
+    def __init__(self, url, models=()):
+        self.url = url.rstrip("/")
+        self.models = set(models)   # What this instance is meant to serve (empty = anything)
+        self.available = None       # Models pulled on the instance (from /api/tags), None = unknown
+        self.loaded = set()         # Models currently warm on the instance
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0           # Consecutive
+        self.ejected_until = 0.0
+
+    def healthy(self, now):
+        return self.ejected_until <= now
+
+    def serves(self, model, strict=True):
+        if self.available is not None and model not in self.available:
+            return False
+        return not strict or not self.models or model in self.models
+
+
+def is_endpoint_failure(error):
+    """Errors that say something about the server (not the request): connection problems and 5xx."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout,
+                          aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None) or getattr(error, "status", None)
+    return status is not None and status >= 500
+
+
+def can_fail_over(error):
+    """
+    Endpoint failures worth retrying on another instance. Read timeouts are not: the
+    request reached a model that was still generating, and re-running it doubles the work.
+    """
+    if isinstance(error, (requests.ReadTimeout, asyncio.TimeoutError)):
+        return False
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return is_endpoint_failure(error) and not isinstance(reason, ReadTimeoutError)
+
+
+def open_stream(session, url, payload):
+    """POST `payload` for a streamed response and return it once the status is OK (closed otherwise)."""
+    response = session.post(url, json=payload, stream=True, timeout=TIMEOUT)
+    try:
+        response.raise_for_status()
+    except requests.HTTPError:
+        response.close()
+        raise
+    return response
+
+
+class OllamaRouter:
+    """
+    Client-side load balancer over several Ollama instances.
+
+    Each request goes to a healthy endpoint meant to serve its model, preferring those that
+    already have the model loaded and, among those, the one with the fewest outstanding
+    requests; a warm endpoint is only left for a cold one once `spill_after` requests queue
+    on it. Endpoints are ejected for `eject_seconds` after a connection error or
+    `eject_after` consecutive 5xx responses, and a background health check (/api/tags and
+    /api/ps) revives them and refreshes which models each instance has pulled and loaded.
+    """
+
+    def __init__(self, endpoints, eject_after=OLLAMA_EJECT_AFTER, eject_seconds=OLLAMA_EJECT_SECONDS,
+                 spill_after=OLLAMA_SPILL_OUTSTANDING, health_interval=OLLAMA_HEALTH_INTERVAL):
+        self.endpoints = [Endpoint(e["url"], e.get("models", ())) if isinstance(e, dict) else Endpoint(e)
+                          for e in endpoints]
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.spill_after = spill_after
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    def pick(self, model, exclude=()):
+        """
+        Choose an endpoint for `model` and count the request as outstanding on it. With
+        `exclude` (a failover), only healthy endpoints other than those are considered and
+        None is returned when there is none.
+        """
+        now = time.time()
+        with self._lock:
+            pool = [e for e in self.endpoints if e not in exclude]
+            healthy = [e for e in pool if e.healthy(now)]
+            candidates = ([e for e in healthy if e.serves(model)]
+                          or [e for e in healthy if e.serves(model, strict=False)])
+            if not candidates:
+                if exclude or not pool:
+                    return None
+                # Everything is ejected: fail open towards whichever comes back first
+                candidates = [min(pool, key=lambda e: e.ejected_until)]
+
+            def load(e):
+                return e.outstanding, e.requests
+
+            warm = [e for e in candidates if model in e.loaded]
+            best = min(warm or candidates, key=load)
+            if warm and best.outstanding >= self.spill_after:
+                coldest = min(candidates, key=load)
+                if coldest.outstanding < best.outstanding:
+                    best = coldest
+            best.outstanding += 1
+            best.requests += 1
+        self._ensure_health_checks()
+        return best
+
+    def release(self, endpoint, model, error=None):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if error is None:
+                endpoint.failures = 0
+                endpoint.loaded.add(model)
+                return
+            if not is_endpoint_failure(error):
+                return
+            endpoint.errors += 1
+            endpoint.failures += 1
+            hard = isinstance(error, (requests.ConnectionError, aiohttp.ClientConnectionError))
+            if hard or endpoint.failures >= self.eject_after:
+                endpoint.ejected_until = time.time() + self.eject_seconds
+                endpoint.loaded.clear()
+                print(f"[WARN] Ollama endpoint {endpoint.url} ejected for {self.eject_seconds}s: {error}")
+
+    @contextmanager
+    def endpoint(self, model, endpoint=None):
+        """
+        `with router.endpoint(model) as url:` - routes one request and records its outcome
+        (`endpoint`: one already picked for it).
+        """
+        endpoint = endpoint or self.pick(model)
+        error = None
+        try:
+            yield endpoint.url
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # Also runs for streams closed early (GeneratorExit), which count as successes
+            self.release(endpoint, model, error)
+
+    def _fail_over(self, endpoint, model, error):
+        """Record a failed first attempt; return another endpoint to retry on, or None."""
+        self.release(endpoint, model, error)
+        other = self.pick(model, exclude=(endpoint,)) if can_fail_over(error) else None
+        if other is not None:
+            print(f"[WARN] Ollama endpoint {endpoint.url} failed ({error}); retrying on {other.url}")
+        return other
+
+    @contextmanager
+    def connect(self, model, open_fn):
+        """
+        `with router.connect(model, open_fn) as (url, result):` - routes one request whose
+        sending part is `open_fn(url)` (POST and read the status or body). If that fails
+        because the endpoint is down, it is retried once on another endpoint. The endpoint
+        counts as outstanding until the block (e.g. reading a stream) ends.
+        """
+        endpoint = self.pick(model)
+        retry = False
+        try:
+            result = open_fn(endpoint.url)
+        except Exception as e:
+            endpoint = self._fail_over(endpoint, model, e)
+            if endpoint is None:
+                raise
+            retry = True
+        with self.endpoint(model, endpoint) as url:
+            if retry:
+                result = open_fn(url)
+            yield url, result
+
+    @asynccontextmanager
+    async def aconnect(self, model, open_fn):
+        """Async `connect`; `open_fn(url)` is a coroutine function."""
+        endpoint = self.pick(model)
+        retry = False
+        try:
+            result = await open_fn(endpoint.url)
+        except Exception as e:
+            endpoint = self._fail_over(endpoint, model, e)
+            if endpoint is None:
+                raise
+            retry = True
+        with self.endpoint(model, endpoint) as url:
+            if retry:
+                result = await open_fn(url)
+            yield url, result
+
+    def request(self, model, send):
+        """Run `send(url)` (a complete request) with `connect`'s failover; returns (url, result)."""
+        with self.connect(model, send) as (url, result):
+            return url, result
+
+    async def arequest(self, model, send):
+        async with self.aconnect(model, send) as (url, result):
+            return url, result
+
+    def check_health(self):
+        """Probe every endpoint once; reachable ones are revived and their model lists refreshed."""
+        session = get_session()
+        for endpoint in self.endpoints:
+            try:
+                tags = session.get(f"{endpoint.url}/api/tags", timeout=OLLAMA_CONNECT_TIMEOUT)
+                tags.raise_for_status()
+                ps = session.get(f"{endpoint.url}/api/ps", timeout=OLLAMA_CONNECT_TIMEOUT)
+                loaded = {m["name"] for m in ps.json().get("models", [])} if ps.ok else None
+            except (requests.RequestException, ValueError) as e:
+                with self._lock:
+                    if endpoint.healthy(time.time()):
+                        print(f"[WARN] Ollama endpoint {endpoint.url} failed its health check: {e}")
+                    endpoint.ejected_until = time.time() + self.eject_seconds
+                    endpoint.loaded.clear()
+                continue
+            with self._lock:
+                endpoint.available = {m["name"] for m in tags.json().get("models", [])}
+                endpoint.available |= {name.split(":")[0] for name in endpoint.available
+                                       if name.endswith(":latest")}
+                if loaded is not None:
+                    endpoint.loaded = loaded
+                endpoint.failures = 0
+                endpoint.ejected_until = 0.0
+
+    def _ensure_health_checks(self):
+        if len(self.endpoints) < 2 or self._health_thread is not None or not self.health_interval:
+            return
+        with self._lock:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            self.check_health()
+            time.sleep(self.health_interval)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return [
+                {"url": e.url, "healthy": e.healthy(now), "outstanding": e.outstanding, "requests": e.requests,
+                 "errors": e.errors, "models": sorted(e.models), "loaded": sorted(e.loaded)}
+                for e in self.endpoints
+            ]
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(base_url=OLLAMA_BASE_URL):
+    """
+    Router for `base_url`: the configured OLLAMA_ENDPOINTS for the default URL, a
+    single-endpoint router for any other (e.g. a URL given on the command line).
+    """
+    with _routers_lock:
+        router = _routers.get(base_url)
+        if router is None:
+            endpoints = OLLAMA_ENDPOINTS if base_url == OLLAMA_BASE_URL else [{"url": base_url}]
+            router = _routers[base_url] = OllamaRouter(endpoints)
+        return router
+
+
+def register_router(base_url, endpoints, **options):
+    """Route requests for `base_url` across `endpoints` (e.g. several local stand-in servers)."""
+    router = OllamaRouter(endpoints, **options)
+    with _routers_lock:
+        _routers[base_url] = router
+    return router
@@ -0,0 +1,123 @@
+# modules/onnx_embeddings.py
+
+import os
+from typing import List
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+from config import EMBED_MODEL, EMBED_BATCH_SIZE, EMBED_ONNX_DIR, EMBED_ONNX_THREADS, EMBED_PARITY_MIN
+
+MODEL_FILE = "model_int8.onnx"
+
+
+def _require(module):
+    try:
+        return __import__(module)
+    except ImportError as e:
+        raise ImportError(
+            f"EMBED_BACKEND 'onnx-int8' needs '{module}' (pip install onnxruntime onnx transformers)"
+        ) from e
+
+
+def export_int8(model_name=EMBED_MODEL, out_dir=EMBED_ONNX_DIR):
+    """
+    Export the sentence-transformer's encoder to ONNX and quantize its weights to int8.
+    One-off step (needs torch); the result only needs onnxruntime and the tokenizer.
+    """
+    torch = _require("torch")
+    transformers = _require("transformers")
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = transformers.AutoTokenizer.from_pretrained(model_name)
+    model = transformers.AutoModel.from_pretrained(model_name).eval()
+    sample = tokenizer(["warm up"], return_tensors="pt")
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model, (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]), fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"], output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "tokens"}
+                          for name in ("input_ids", "attention_mask", "token_type_ids", "last_hidden_state")},
+            opset_version=14,
+        )
+    quantize_dynamic(fp32_path, os.path.join(out_dir, MODEL_FILE), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+    tokenizer.save_pretrained(out_dir)
+    return os.path.join(out_dir, MODEL_FILE)
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    all-MiniLM-L6-v2 on ONNX Runtime with int8 weights, for CPU-only nodes.
+
+    Mirrors the sentence-transformers pipeline (mean pooling over the attention mask,
+    then L2 normalisation). Texts are sorted by length before batching to keep padding
+    low, and ONNX Runtime uses `threads` intra-op threads per batch. The model is
+    exported on first use if `model_dir` does not contain it yet.
+    """
+
+    def __init__(self, model_dir=EMBED_ONNX_DIR, model_name=EMBED_MODEL, batch_size=EMBED_BATCH_SIZE,
+                 threads=EMBED_ONNX_THREADS, max_length=256):
+        ort = _require("onnxruntime")
+        transformers = _require("transformers")
+        path = os.path.join(model_dir, MODEL_FILE)
+        if not os.path.exists(path):
+            print(f"[INFO] Exporting {model_name} to int8 ONNX in {model_dir} ...")
+            export_int8(model_name, model_dir)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or os.cpu_count() or 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def _encode(self, texts):
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        feeds = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+        if "token_type_ids" in self.input_names and "token_type_ids" not in feeds:
+            feeds["token_type_ids"] = np.zeros_like(feeds["input_ids"])
+        hidden = self.session.run(None, feeds)[0]
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+def parity_check(reference, candidate, texts, min_cosine=EMBED_PARITY_MIN):
+    """
+    Cosine similarity between two backends' vectors for the same texts.
+    Returns {"mean", "min", "ok"}; ok means every text reached `min_cosine`.
+    """
+    a = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    b = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    cos = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {"mean": round(float(cos.mean()), 4), "min": round(float(cos.min()), 4),
+            "ok": bool(cos.min() >= min_cosine)}
+
+
+if __name__ == "__main__":
+    # python -m modules.onnx_embeddings [export | parity]
+    import sys
+    from langchain.embeddings import HuggingFaceEmbeddings
+    from modules.fake_ollama import fake_invoice
+    from modules.rag_store import build_document
+
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        print(f"Wrote {export_int8()}")
+    else:
+        texts = [build_document(fake_invoice(f"parity-{i}")).page_content for i in range(200)]
+        texts += ["What did we pay Acme in April 2023?", "invoice number 4711", "toner"]
+        print(parity_check(HuggingFaceEmbeddings(model_name=EMBED_MODEL), OnnxEmbeddings(), texts))
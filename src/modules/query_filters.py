@@ -0,0 +1,200 @@
+# modules/query_filters.py
+
+import calendar
+import json
+import re
+from config import QUERY_FILTER_LLM_FALLBACK
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+DOCUMENT_TYPES = {"invoice": "invoice", "invoices": "invoice", "check": "check", "checks": "check",
+                  "cheque": "check", "cheques": "check", "receipt": "receipt", "receipts": "receipt"}
+
+_MONTH = "|".join(sorted(MONTHS, key=len, reverse=True))
+_MONTH_YEAR = re.compile(rf"\b({_MONTH})\.?\s+(\d{{4}})\b", re.I)
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+_QUARTER = re.compile(r"\bQ([1-4])\s*(\d{4})\b", re.I)
+_YEAR = re.compile(r"\b(?:in|from|during|of|for|year)\s+((?:19|20)\d{2})\b", re.I)
+_OTHER_YEAR = re.compile(r"(?:\b(?:and|or|to|versus|vs)\.?|,)\s*((?:19|20)\d{2})\b", re.I)  # "in 2022 and 2023"
+_MONEY = r"(?:[$€£]\s*)?(\d[\d,]*(?:\.\d+)?)\s*(?:usd|eur|gbp|dollars?|euros?)?"
+_AMOUNT_BETWEEN = re.compile(rf"\bbetween\s+{_MONEY}\s+and\s+{_MONEY}", re.I)
+_AMOUNT_MIN = re.compile(rf"\b(?:over|above|more than|greater than|at least|exceeding)\s+{_MONEY}", re.I)
+_AMOUNT_MAX = re.compile(rf"\b(?:under|below|less than|at most|up to)\s+{_MONEY}", re.I)
+# A number only counts as an amount with a currency (in the match) or an amount word shortly before it:
+# "more than 3 times" is not a total
+_CURRENCY = re.compile(r"[$€£]|\b(?:usd|eur|gbp|dollars?|euros?)\b", re.I)
+_AMOUNT_WORD = re.compile(r"\b(?:totals?|total(?:l)?ing|amounts?|amounting|sum|spent|spend(?:ing)?|costs?|costing|"
+                          r"paid|payments?|billed|worth|value[ds]?|price[ds]?)\b\W+(?:\w+\W+){0,3}$", re.I)
+_QUOTED = re.compile(r"['\"‘“]([^'\"’”]{2,})['\"’”]")
+_FULL_MONTH = "|".join(name.lower() for name in calendar.month_name if name)
+# Value-bearing phrases that suggest a constraint the rules may have missed (worth an
+# LLM call): a month with a day or year, a comparison with an amount, month or year, or
+# a year on its own. Bare words ("May I see...", "over the phone") are not cues.
+_FILTER_CUES = re.compile(
+    rf"\b(?:{_MONTH})\.?\s+\d{{1,4}}(?:st|nd|rd|th)?\b"
+    rf"|\b\d{{1,2}}(?:st|nd|rd|th)?\s+(?:of\s+)?(?:{_MONTH})\b"
+    rf"|\b(?:in|from|during|since|before|after|until|till)\s+(?:{_FULL_MONTH})\b"
+    rf"|\b(?:between|after|before|since|until|over|under|above|below|exceeding|more than|less than|"
+    rf"greater than|at least|at most|up to)\s+(?:the\s+)?(?:[$€£]\s*\d|\d|(?:{_MONTH})\b)"
+    r"|(?<![\w#/-])(?:19|20)\d{2}(?![\w/-])",
+    re.I
+)
+
+FILTER_PROMPT = (
+    "Extract search filters from the question about invoices, checks and receipts.\n"
+    "Return only JSON with these keys (null when not mentioned): vendor (string), "
+    "date_from and date_to (YYYY-MM-DD), document_type (invoice, check or receipt), "
+    "min_total and max_total (numbers).\n\nQuestion: {query}\nJSON:"
+)
+
+
+def _month_range(year, month):
+    return year * 10000 + month * 100 + 1, year * 10000 + month * 100 + calendar.monthrange(year, month)[1]
+
+
+def _money(text):
+    return float(text.replace(",", ""))
+
+
+def _normalize(value):
+    return " ".join(re.findall(r"[a-z0-9]+", str(value).lower()))
+
+
+def rule_filters(query, vendors=()):
+    """
+    Filters found by pattern rules: vendor (a known vendor named or quoted in the query),
+    date range as YYYYMMDD ints, document type and total range.
+    """
+    filters = {}
+    padded = f" {_normalize(query)} "
+    quoted = {_normalize(q) for q in _QUOTED.findall(query)}
+    named = [v for v in vendors if _normalize(v) and (f" {_normalize(v)} " in padded or _normalize(v) in quoted)]
+    if named:
+        filters["vendor"] = sorted(set(named))
+
+    # "March 2023 or May 2023" is not one range: no date filter then
+    dates = _date_ranges(query)
+    if len(dates) == 1:
+        filters["date_from"], filters["date_to"] = dates[0]
+
+    types = {DOCUMENT_TYPES[w] for w in re.findall(r"[a-z]+", query.lower()) if w in DOCUMENT_TYPES}
+    # "the check number for invoice #12" names two types: no filter then
+    if len(types) == 1 and not re.search(r"\b(check|invoice|po)\s*(number|no|#)", query, re.I):
+        filters["document_type"] = types.pop()
+
+    if m := _amount_match(_AMOUNT_BETWEEN, query):
+        filters["min_total"], filters["max_total"] = sorted((_money(m.group(1)), _money(m.group(2))))
+    else:
+        if m := _amount_match(_AMOUNT_MIN, query):
+            filters["min_total"] = _money(m.group(1))
+        if m := _amount_match(_AMOUNT_MAX, query):
+            filters["max_total"] = _money(m.group(1))
+    return filters
+
+
+def _date_ranges(query):
+    """Distinct (from, to) YYYYMMDD ranges the query mentions; a year is dropped when a date inside it is named."""
+    ranges = [(int(m.group(1) + m.group(2) + m.group(3)),) * 2 for m in _ISO_DATE.finditer(query)]
+    ranges += [_month_range(int(m.group(2)), MONTHS[m.group(1).lower()]) for m in _MONTH_YEAR.finditer(query)]
+    for m in _QUARTER.finditer(query):
+        year, quarter = int(m.group(2)), int(m.group(1))
+        ranges.append((_month_range(year, quarter * 3 - 2)[0], _month_range(year, quarter * 3)[1]))
+    amounts = [m.span() for pattern in (_AMOUNT_BETWEEN, _AMOUNT_MIN, _AMOUNT_MAX) for m in pattern.finditer(query)]
+    years = [m for pattern in (_YEAR, _OTHER_YEAR) for m in pattern.finditer(query)]
+    if ranges or _YEAR.search(query):
+        for m in years:
+            if any(start <= m.start(1) < end for start, end in amounts):
+                continue  # "between $1000 and 2000" names amounts, not years
+            year = (int(m.group(1)) * 10000 + 101, int(m.group(1)) * 10000 + 1231)
+            if not any(year[0] <= start and end <= year[1] for start, end in ranges):
+                ranges.append(year)
+    return list(dict.fromkeys(ranges))
+
+
+def _amount_match(pattern, query):
+    """First match of an amount pattern whose number is money (currency or amount word), else None."""
+    for m in pattern.finditer(query):
+        if _CURRENCY.search(m.group(0)) or _AMOUNT_WORD.search(query[:m.start()]):
+            return m
+    return None
+
+
+def llm_filters(query, llm, vendors=()):
+    """Ask the LLM for the same filters; anything it returns that cannot be used is dropped."""
+    try:
+        raw = llm.invoke(FILTER_PROMPT.format(query=query))
+        data = json.loads(raw[raw.index("{"):raw.rindex("}") + 1])
+    except (ValueError, TypeError) as e:
+        print(f"[WARN] Filter extraction by LLM failed: {e}")
+        return {}
+    filters = {}
+    vendor = _normalize(data.get("vendor") or "")
+    if vendor:
+        named = [v for v in vendors if _normalize(v) == vendor or vendor in _normalize(v)]
+        if named:
+            filters["vendor"] = sorted(set(named))
+    for key in ("date_from", "date_to"):
+        if m := _ISO_DATE.search(str(data.get(key) or "")):
+            filters[key] = int(m.group(1) + m.group(2) + m.group(3))
+    if str(data.get("document_type") or "").lower() in DOCUMENT_TYPES:
+        filters["document_type"] = DOCUMENT_TYPES[data["document_type"].lower()]
+    for key in ("min_total", "max_total"):
+        try:
+            if data.get(key) is not None:
+                filters[key] = float(data[key])
+        except (TypeError, ValueError):
+            pass
+    return filters
+
+
+def extract_filters(query, vendors=(), llm=None, llm_fallback=QUERY_FILTER_LLM_FALLBACK):
+    """Rules first; the LLM is only asked when the rules found nothing but the query hints at a constraint."""
+    filters = rule_filters(query, vendors)
+    if not filters and llm is not None and llm_fallback and _FILTER_CUES.search(query):
+        filters = llm_filters(query, llm, vendors)
+    return filters
+
+
+def to_chroma_where(filters, document_types=None):
+    """
+    Chroma `where` clause for the filters (None if there are none). `document_types` maps
+    a normalised type to the spellings stored in the collection (e.g. "invoice" -> ["Invoice"]).
+    """
+    clauses = []
+    if filters.get("vendor"):
+        clauses.append({"vendor": {"$in": list(filters["vendor"])}})
+    if "date_from" in filters:
+        clauses.append({"date_num": {"$gte": filters["date_from"]}})
+    if "date_to" in filters:
+        clauses.append({"date_num": {"$lte": filters["date_to"]}})
+    if filters.get("document_type"):
+        spellings = (document_types or {}).get(filters["document_type"]) or [filters["document_type"]]
+        clauses.append({"document_type": {"$in": list(spellings)}})
+    if "min_total" in filters:
+        clauses.append({"total_num": {"$gte": filters["min_total"]}})
+    if "max_total" in filters:
+        clauses.append({"total_num": {"$lte": filters["max_total"]}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def matches(metadata, filters):
+    """Python equivalent of `to_chroma_where`, for candidates coming from the in-memory indexes."""
+    if filters.get("vendor") and metadata.get("vendor") not in filters["vendor"]:
+        return False
+    date = metadata.get("date_num") or 0
+    if "date_from" in filters and date < filters["date_from"]:
+        return False
+    if "date_to" in filters and date > filters["date_to"]:
+        return False
+    if filters.get("document_type") and DOCUMENT_TYPES.get(
+            _normalize(metadata.get("document_type", "")), _normalize(metadata.get("document_type", ""))
+    ) != filters["document_type"]:
+        return False
+    total = metadata.get("total_num")
+    if "min_total" in filters and (total is None or total < filters["min_total"]):
+        return False
+    if "max_total" in filters and (total is None or total > filters["max_total"]):
+        return False
+    return True
@@ -0,0 +1,91 @@
+# modules/rag_context.py
+
+import json
+import re
+from collections import OrderedDict
+from langchain.schema import Document
+from config import CONTEXT_TOKEN_BUDGET
+
+# Header fields in the order they are written; empty ones are left out
+HEADER_FIELDS = (
+    ("document_type", "Type"), ("vendor", "Vendor"), ("customer_name", "Customer"),
+    ("invoice_number", "Invoice #"), ("check_number", "Check #"), ("po_number", "PO #"),
+    ("date", "Date"), ("due_date", "Due"), ("payment_date", "Paid"), ("subtotal", "Subtotal"),
+    ("tax", "Tax"), ("total", "Total"), ("currency", "Currency"), ("payment_method", "Payment"),
+)
+
+# Enough to identify the document a matched line item belongs to
+ITEM_PARENT_FIELDS = (("vendor", "Vendor"), ("invoice_number", "Invoice #"), ("date", "Date"), ("total", "Total"))
+# A page line holding a field label but no value
+_EMPTY_FIELD = re.compile(r"^[A-Za-z][\w #/.]*:$")
+
+
+def estimate_tokens(text):
+    """Rough prompt token count (about 4 characters per token for llama3 on this kind of text)."""
+    return (len(text) + 3) // 4
+
+
+def drop_empty_fields(text):
+    """Page text without indentation and without field lines that have no value ("Check #:", "Bank:")."""
+    lines = [line.strip() for line in text.splitlines()]
+    return "\n".join(line for line in lines if line and (line == "Line Items:" or not _EMPTY_FIELD.match(line)))
+
+
+def compact_header(meta, fields=HEADER_FIELDS):
+    """One line with the non-empty header fields of a document."""
+    return "; ".join(f"{label}: {meta[key]}" for key, label in fields if meta.get(key) not in (None, "", "[]"))
+
+
+def item_line(item):
+    return f"- {item.get('qty', '')} x {item.get('item', '')} @ {item.get('price', '')} = {item.get('total', '')}"
+
+
+def _parent_items(meta):
+    try:
+        items = json.loads(meta.get("items") or "[]")
+    except (TypeError, ValueError):
+        return []
+    return [item for item in items if isinstance(item, dict)]
+
+
+def assemble_context(chunks, docs, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Turn retrieved chunks (in rank order) into one compact Document per parent document:
+    its header line, then the line items that matched. When the header chunk (or a whole
+    page, for stores indexed in "document" mode) matched, the full header and all items
+    are listed; parents found only through items get a short identifying header.
+    `docs` maps IDs to the indexed Documents, to find the parent of an item chunk. Blocks
+    and item lines are added in rank order until `budget` tokens are used; the best match
+    is always kept.
+    """
+    groups = OrderedDict()
+    for chunk in chunks:
+        meta = chunk.metadata
+        parent_id = meta.get("parent_id") or meta.get("id")
+        group = groups.setdefault(parent_id, {"items": [], "whole": False})
+        if meta.get("chunk") == "item":
+            group["items"].append({"item": meta.get("item", ""), "qty": meta.get("qty", ""),
+                                   "price": meta.get("price", ""), "total": meta.get("line_total", "")})
+        else:
+            group["whole"] = True
+
+    blocks, used = [], 0
+    for parent_id, group in groups.items():
+        parent = docs.get(parent_id)
+        meta = parent.metadata if parent is not None else {}
+        fields = HEADER_FIELDS if group["whole"] else ITEM_PARENT_FIELDS
+        lines = [compact_header(meta, fields) or f"Document {parent_id}"]
+        items = _parent_items(meta) if group["whole"] else group["items"]
+        cost = estimate_tokens(lines[0]) + 1
+        if blocks and used + cost > budget:
+            break
+        for item in items:
+            line = item_line(item)
+            if used + cost + estimate_tokens(line) + 1 > budget:
+                lines.append(f"- ... {len(items) - len(lines) + 1} more items")
+                break
+            lines.append(line)
+            cost += estimate_tokens(line) + 1
+        used += cost
+        blocks.append(Document(page_content="\n".join(lines), metadata={"id": parent_id}))
+    return blocks
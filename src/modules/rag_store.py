@@ -1,34 +1,123 @@
 # modules/rag_store.py
 
 import json
+import re
+import threading
+import time
+import warnings
+from collections import defaultdict
+from typing import Any, List, Optional, Sequence
+import pandas as pd
 from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.vectorstores import Chroma
-from langchain.schema import Document
-from config import CHROMA_DB_DIR
+from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
+from langchain.schema import BaseRetriever, Document
+from config import (
+    CHROMA_DB_DIR, EMBED_MODEL, EMBED_BACKEND, EMBED_BATCH_SIZE, EMBED_CACHE_ENABLED, ADD_DOCS_BATCH_SIZE,
+    HYBRID_ID_FIELDS, RETRIEVER_K, RETRIEVER_FETCH_K, RRF_K, QUERY_FILTERS, CHUNKING_MODE, CONTEXT_ASSEMBLY,
+    CONTEXT_TOKEN_BUDGET, CONTEXT_DROP_EMPTY_FIELDS, RERANK_ENABLED, RERANK_FETCH_K
+)
+from modules.bm25 import BM25, tokenize
+from modules.embedding_cache import CachedEmbeddings, get_embedding_cache
+from modules.query_filters import DOCUMENT_TYPES, extract_filters, to_chroma_where, matches
+from modules.rag_context import assemble_context, drop_empty_fields
+from modules.reranker import rerank_documents, get_context_stats
 import uuid
 
+# Bumped on every write so caches built on top of the store can tell its data changed
+_data_version = 0
 
-def init_vectorstore():
+
+def data_version(vectorstore):
+    """Version of the stored invoice data: local write counter plus collection size (catches other processes)."""
+    return f"{_data_version}:{vectorstore._collection.count()}"
+
+
+def _bump_data_version():
+    global _data_version
+    _data_version += 1
+
+
+_embeddings = None
+_vectorstores = {}
+_init_lock = threading.Lock()
+
+
+def load_embedding_backend(backend=EMBED_BACKEND):
     """
-    Initialize or load Chroma vector store using a local embedding model.
-    This avoids OpenAI and is compatible with fully local RAG setups.
+    Build the embedding model selected by EMBED_BACKEND. Returns (embeddings, name);
+    the name keys the embedding cache, as each backend's vectors differ slightly.
     """
+    if backend == "onnx-int8":
+        from modules.onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings(), f"{EMBED_MODEL}:onnx-int8"
+    if backend != "torch":
+        raise ValueError(f"Unknown EMBED_BACKEND '{backend}' (expected 'torch' or 'onnx-int8')")
     embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2"
-    )
-    return Chroma(
-        collection_name="checks",
-        embedding_function=embeddings,
-        persist_directory=CHROMA_DB_DIR
+        model_name=EMBED_MODEL,
+        encode_kwargs={"batch_size": EMBED_BATCH_SIZE}
     )
+    return embeddings, EMBED_MODEL
 
 
-def add_doc(vectorstore, parsed_data):
+def get_embeddings():
     """
-    Store a parsed document (OCR result) in the vector store with rich page content and metadata.
-    This improves semantic retrieval by embedding actual content, not just placeholder text.
+    Process-wide embedding model, loaded on first use. Loading torch and the
+    sentence-transformer takes seconds, so every vector store shares one instance.
+    """
+    global _embeddings
+    if _embeddings is None:
+        with _init_lock:
+            if _embeddings is None:
+                embeddings, cache_name = load_embedding_backend()
+                if EMBED_CACHE_ENABLED:
+                    # Re-ingested documents and repeated queries skip the encoder
+                    embeddings = CachedEmbeddings(embeddings, cache_name, get_embedding_cache())
+                _embeddings = embeddings
+    return _embeddings
+
+
+def init_vectorstore(persist_directory=CHROMA_DB_DIR):
+    """
+    Initialize or load Chroma vector store using a local embedding model.
+    This avoids OpenAI and is compatible with fully local RAG setups.
+    The store (and its Chroma client) is created once per directory and process.
     """
+    with _init_lock:
+        vectorstore = _vectorstores.get(persist_directory)
+    if vectorstore is None:
+        embeddings = get_embeddings()
+        with _init_lock:
+            vectorstore = _vectorstores.get(persist_directory)
+            if vectorstore is None:
+                vectorstore = _vectorstores[persist_directory] = Chroma(
+                    collection_name="checks",
+                    embedding_function=embeddings,
+                    persist_directory=persist_directory
+                )
+    return vectorstore
+
+
+def warm_up():
+    """Load the embedding model and run one encode so the first real query is fast. Returns timings (s)."""
+    t = time.perf_counter()
+    embeddings = get_embeddings()
+    load_s = time.perf_counter() - t
+    t = time.perf_counter()
+    # Straight to the model: a cache hit would skip the encoder we want to warm
+    getattr(embeddings, "embeddings", embeddings).embed_query("warm up")
+    encode_s = time.perf_counter() - t
+    t = time.perf_counter()
+    init_vectorstore()
+    return {"model_load_s": round(load_s, 3), "first_encode_s": round(encode_s, 3),
+            "vectorstore_s": round(time.perf_counter() - t, 3)}
+
 
+def build_document(parsed_data, doc_id=None):
+    """
+    Turn a parsed document (OCR result) into a Document with rich page content and metadata.
+    This improves semantic retrieval by embedding actual content, not just placeholder text.
+    """
     # Define schema with all expected fields
     fields = {
         "invoice_number": "",
@@ -59,6 +148,40 @@ def add_doc(vectorstore, parsed_data):
 
     fields.update(parsed_data)
 
+    # Safe metadata: convert non-scalar types (list/dict) to JSON strings
+    def safe_value(v):
+        if isinstance(v, (str, int, float, bool)) or v is None:
+            return v
+        return json.dumps(v, ensure_ascii=False)
+
+    # Add unique ID for tracking
+    doc_id = doc_id or str(uuid.uuid4())
+    fields["id"] = doc_id
+
+    # Safe metadata
+    clean_metadata = {k: safe_value(v) for k, v in fields.items()}
+    clean_metadata.update(numeric_metadata(fields))
+
+    return Document(
+        page_content=page_text(fields),
+        metadata=clean_metadata,
+        id=doc_id
+    )
+
+
+def page_text(fields):
+    """
+    Searchable page text of a document: what is embedded, and what the LLM was given per
+    document before context assembly. `fields` may be stored metadata (items as JSON).
+    """
+    fields = defaultdict(str, fields)
+    items = fields["items"]
+    if isinstance(items, str):
+        try:
+            items = json.loads(items or "[]")
+        except ValueError:
+            items = []
+
     # ⬇ Build searchable text content for embedding
     page_text = f"""
         Document Type: {fields['document_type']}
@@ -81,34 +204,163 @@ def add_doc(vectorstore, parsed_data):
         """
 
     # Add items if available
-    if fields["items"]:
+    if items:
         page_text += "\nLine Items:\n"
-        for item in fields["items"]:
+        for item in items:
             item_line = f"- {item.get('qty', '')} x {item.get('item', '')} @ {item.get('price', '')} = {item.get('total', '')}"
             page_text += item_line + "\n"
+    return page_text.strip()
 
-    # Safe metadata: convert non-scalar types (list/dict) to JSON strings
-    def safe_value(v):
-        if isinstance(v, (str, int, float, bool)) or v is None:
-            return v
-        return json.dumps(v, ensure_ascii=False)
 
-    # Add unique ID for tracking
-    doc_id = str(uuid.uuid4())
-    fields["id"] = doc_id
+# Metadata copied onto line-item chunks so the query filters apply to them too
+ITEM_FILTER_KEYS = ("vendor", "document_type", "date_num", "total_num")
 
-    # Safe metadata
-    clean_metadata = {k: safe_value(v) for k, v in fields.items()}
 
-    # Create Document for vector store
-    doc = Document(
-        page_content=page_text.strip(),
-        metadata=clean_metadata,
-        id=doc_id
+def build_chunks(parsed_data, doc_id=None, mode=CHUNKING_MODE):
+    """
+    Documents to index for one parsed document. In "document" mode that is the single
+    `build_document` page. In "items" mode it is a header chunk (the page without line
+    items; same ID and metadata as the document) plus one chunk per line item, linked
+    to it by `parent_id`.
+    """
+    doc = build_document(parsed_data, doc_id)
+    if mode != "items":
+        return [doc]
+    meta = doc.metadata
+    doc_id = meta["id"]
+    header = Document(
+        page_content=doc.page_content.split("\nLine Items:")[0].strip(),
+        metadata={**meta, "chunk": "header", "parent_id": doc_id}
     )
+    context = ", ".join(
+        f"{label}: {meta[key]}" for key, label in
+        (("vendor", "Vendor"), ("date", "Date"), ("invoice_number", "Invoice #")) if meta.get(key)
+    )
+    chunks = [header]
+    for n, item in enumerate(parsed_data.get("items") or []):
+        if not isinstance(item, dict):
+            continue
+        line = f"{item.get('qty', '')} x {item.get('item', '')} @ {item.get('price', '')} = {item.get('total', '')}"
+        chunk_id = f"{doc_id}:item:{n}"
+        chunks.append(Document(
+            page_content=f"Line item: {line} ({context})",
+            metadata={
+                "id": chunk_id, "chunk": "item", "parent_id": doc_id, "item_index": n,
+                "item": str(item.get("item", "")), "qty": str(item.get("qty", "")),
+                "price": str(item.get("price", "")), "line_total": str(item.get("total", "")),
+                **{key: meta[key] for key in ITEM_FILTER_KEYS if key in meta},
+            },
+            id=chunk_id
+        ))
+    return chunks
+
+
+
+def baseline_pages(docs, parents, k=RETRIEVER_K):
+    """
+    The context the LLM got before chunking and post-processing: the whole pages of the
+    first `k` distinct documents among the retrieved `docs`. `parents` maps document ID
+    to its stored metadata.
+    """
+    pages, seen = [], set()
+    for doc in docs:
+        parent_id = doc.metadata.get("parent_id") or doc.metadata.get("id")
+        if parent_id in seen:
+            continue
+        seen.add(parent_id)
+        meta = parents.get(parent_id) or doc.metadata
+        pages.append(Document(page_content=page_text(meta), metadata=meta))
+        if len(pages) == k:
+            break
+    return pages
+
+def numeric_metadata(fields):
+    """
+    Sortable numeric copies of the date (YYYYMMDD int) and total, for range filters in
+    Chroma `where` clauses. Keys are left out when the value cannot be parsed.
+    """
+    numeric = {}
+    raw_date = str(fields.get("date") or "").strip()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        # Dotted dates (05.04.2023) are day-first; everything else is parsed like analytics does
+        date = pd.to_datetime(raw_date or None, errors="coerce",
+                              dayfirst=bool(re.fullmatch(r"\d{1,2}\.\d{1,2}\.\d{2,4}", raw_date)))
+    if not pd.isna(date):
+        numeric["date_num"] = date.year * 10000 + date.month * 100 + date.day
+    try:
+        numeric["total_num"] = float(re.sub(r"[^\d.\-]", "", str(fields.get("total") or "")))
+    except ValueError:
+        pass
+    return numeric
+
+
+def backfill_numeric_metadata(vectorstore):
+    """Add date_num/total_num to documents stored before those fields existed. Returns the number updated."""
+    stored = vectorstore.get(include=["metadatas"])
+    ids, metadatas = [], []
+    for doc_id, meta in zip(stored["ids"], stored["metadatas"]):
+        numeric = numeric_metadata(meta or {})
+        if any((meta or {}).get(k) != v for k, v in numeric.items()):
+            ids.append(doc_id)
+            metadatas.append({**meta, **numeric})
+    if ids:
+        vectorstore._collection.update(ids=ids, metadatas=metadatas)
+        vectorstore.persist()
+        _bump_data_version()
+        index = _indexes.get(id(vectorstore))
+        if index is not None:
+            index.clear()
+    return len(ids)
+
+
+def add_doc(vectorstore, parsed_data, doc_id=None, chunking=CHUNKING_MODE):
+    """
+    Store a parsed document (OCR result) in the vector store, as one page or as header
+    and line-item chunks (see `build_chunks`).
+    Passing a stable `doc_id` makes the insert idempotent: if a document with that ID is
+    already stored, nothing is added. Returns the document ID.
+    """
+    if doc_id is not None and vectorstore.get(ids=[doc_id])["ids"]:
+        return doc_id
 
-    vectorstore.add_documents([doc], ids=[doc_id])
+    chunks = build_chunks(parsed_data, doc_id, chunking)
+    vectorstore.add_documents(chunks, ids=[chunk.metadata["id"] for chunk in chunks])
     vectorstore.persist()
+    _index_documents(vectorstore, chunks)
+    _bump_data_version()
+    return chunks[0].metadata["id"]
+
+
+def add_docs(vectorstore, parsed_list, batch_size=ADD_DOCS_BATCH_SIZE, doc_ids=None, chunking=CHUNKING_MODE):
+    """
+    Bulk version of `add_doc`: builds all documents in one pass, then embeds and inserts
+    them `batch_size` documents (with their chunks) at a time (the embedding model batches
+    within each) with one persist per batch. IDs already stored, or repeated in `doc_ids`,
+    are skipped. Returns the document IDs in input order.
+    """
+    doc_ids = list(doc_ids) if doc_ids is not None else [None] * len(parsed_list)
+    known = [i for i in doc_ids if i is not None]
+    skip = set(vectorstore.get(ids=known)["ids"]) if known else set()
+
+    ids, docs = [], []
+    for parsed_data, doc_id in zip(parsed_list, doc_ids):
+        if doc_id is not None and doc_id in skip:
+            ids.append(doc_id)
+            continue
+        chunks = build_chunks(parsed_data, doc_id, chunking)
+        skip.add(chunks[0].metadata["id"])
+        ids.append(chunks[0].metadata["id"])
+        docs.append(chunks)
+
+    for start in range(0, len(docs), batch_size):
+        batch = [chunk for chunks in docs[start:start + batch_size] for chunk in chunks]
+        vectorstore.add_documents(batch, ids=[doc.metadata["id"] for doc in batch])
+        vectorstore.persist()
+        _index_documents(vectorstore, batch)
+    if docs:
+        _bump_data_version()
+    return ids
 
 
 def clear_vectorstore(vectorstore):
@@ -121,6 +373,10 @@ def clear_vectorstore(vectorstore):
 
         if all_ids:
             vectorstore.delete(ids=all_ids)
+            _bump_data_version()
+            index = _indexes.get(id(vectorstore))
+            if index is not None:
+                index.clear()
             print("All documents deleted by ID.")
         else:
             print("No documents found to delete.")
@@ -130,3 +386,261 @@ def clear_vectorstore(vectorstore):
 
 
 
+
+
+
+# --- Hybrid retrieval ------------------------------------------------------------
+
+_ID_CANDIDATE = re.compile(r"[A-Za-z0-9][A-Za-z0-9\-/.]*")
+
+
+def identifier_keys(value):
+    """Lookup keys of an invoice/check/PO number: alphanumerics only, plus the bare digits ("INV-0123" -> 0123)."""
+    value = str(value or "").upper()
+    keys = set()
+    compact = re.sub(r"[^A-Z0-9]", "", value)
+    if compact:
+        keys.add(compact)
+    digits = re.sub(r"\D", "", value)
+    if len(digits) >= 3:
+        keys.add(digits)
+    return keys
+
+
+def normalize_name(value):
+    return " ".join(tokenize(value))
+
+
+class HybridIndex:
+    """
+    In-memory indexes kept next to the Chroma collection: an inverted index from
+    identifier fields and vendor names to document IDs, and a BM25 index over the page
+    text. Filled from add_doc/add_docs, and reloaded from Chroma whenever the collection
+    size shows that another process wrote to it.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}                                      # id -> Document
+        self.identifiers = {f: {} for f in HYBRID_ID_FIELDS}  # field -> key -> set of ids
+        self.vendors = {}                                   # normalized vendor -> set of ids
+        self.text_index = BM25(k1, b)                       # over the page text
+        self.lock = threading.RLock()
+
+    def clear(self):
+        with self.lock:
+            self.__init__(self.k1, self.b)
+
+    def add(self, docs):
+        with self.lock:
+            for doc in docs:
+                doc_id = doc.metadata.get("id")
+                if doc_id in self.docs:
+                    self._remove(doc_id)
+                self.docs[doc_id] = doc
+                for field in HYBRID_ID_FIELDS:
+                    for key in identifier_keys(doc.metadata.get(field)):
+                        self.identifiers[field].setdefault(key, set()).add(doc_id)
+                vendor = normalize_name(doc.metadata.get("vendor"))
+                if vendor:
+                    self.vendors.setdefault(vendor, set()).add(doc_id)
+                self.text_index.add(doc_id, doc.page_content)
+
+    def _remove(self, doc_id):
+        doc = self.docs.pop(doc_id)
+        for table in (*self.identifiers.values(), self.vendors):
+            for ids in table.values():
+                ids.discard(doc_id)
+        self.text_index.remove(doc_id, doc.page_content)
+
+    def sync(self, vectorstore):
+        """Reload from Chroma if the collection holds a different number of documents."""
+        count = vectorstore._collection.count()
+        with self.lock:
+            if count == len(self.docs):
+                return
+            stored = vectorstore.get(include=["documents", "metadatas"])
+            self.clear()
+            self.add([
+                Document(page_content=text or "", metadata={**(meta or {}), "id": doc_id})
+                for doc_id, text, meta in zip(stored["ids"], stored["documents"], stored["metadatas"])
+            ])
+
+    def vendor_names(self):
+        with self.lock:
+            return {doc.metadata.get("vendor") for doc in self.docs.values() if doc.metadata.get("vendor")}
+
+    def document_types(self):
+        """Normalised document type -> the spellings stored for it."""
+        types = {}
+        with self.lock:
+            for doc in self.docs.values():
+                spelling = doc.metadata.get("document_type")
+                if spelling:
+                    key = DOCUMENT_TYPES.get(normalize_name(spelling), normalize_name(spelling))
+                    types.setdefault(key, set()).add(spelling)
+        return {key: sorted(spellings) for key, spellings in types.items()}
+
+    def lookup(self, query):
+        """
+        Documents whose invoice/check/PO number appears in the query, then those whose
+        vendor is named in it. Returns (ids, identifier_hit); no embedding involved.
+        """
+        keys = set()
+        for token in _ID_CANDIDATE.findall(query):
+            if any(ch.isdigit() for ch in token):
+                keys |= identifier_keys(token)
+        ids = []
+        with self.lock:
+            for field in HYBRID_ID_FIELDS:
+                for key in keys:
+                    ids.extend(self.identifiers[field].get(key, ()))
+            identifier_hit = bool(ids)
+            padded = f" {normalize_name(query)} "
+            for vendor, vendor_ids in self.vendors.items():
+                if f" {vendor} " in padded:
+                    ids.extend(vendor_ids)
+        return list(dict.fromkeys(ids)), identifier_hit
+
+    def bm25(self, query, k):
+        """Top-`k` document IDs by Okapi BM25 over the page text."""
+        with self.lock:
+            return self.text_index.top(query, k)
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge ranked ID lists: each ID scores sum(1 / (k + rank)) over the lists it appears in."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_hybrid_index(vectorstore):
+    """The hybrid index of `vectorstore`, built from its contents on first use."""
+    with _indexes_lock:
+        index = _indexes.get(id(vectorstore))
+        if index is None:
+            index = _indexes[id(vectorstore)] = HybridIndex()
+    index.sync(vectorstore)
+    return index
+
+
+def _index_documents(vectorstore, docs):
+    index = _indexes.get(id(vectorstore))
+    if index is not None:
+        index.add(docs)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing exact identifier/vendor matches, BM25 and Chroma vector search by
+    reciprocal rank. When the query names a known invoice, check or PO number the
+    vector search (and its embedding call) is skipped.
+    """
+    vectorstore: Any
+    k: int = RETRIEVER_K
+    fetch_k: int = RETRIEVER_FETCH_K
+    # Vendor/date/type/amount constraints in the question become metadata filters;
+    # `filter_llm` is asked only when the rules find none
+    use_filters: bool = QUERY_FILTERS
+    filter_llm: Any = None
+    # Hand the LLM compact per-document blocks (header line + matched items) under a token budget
+    assemble: bool = CONTEXT_ASSEMBLY
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    # Over-fetch `rerank_fetch_k` candidates and rerank them down to `k`; without assembly,
+    # pages are sent without their empty fields
+    rerank: bool = RERANK_ENABLED
+    rerank_fetch_k: int = RERANK_FETCH_K
+    drop_empty: bool = CONTEXT_DROP_EMPTY_FIELDS
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        index = get_hybrid_index(self.vectorstore)
+        exact, identifier_hit = index.lookup(query)
+        if identifier_hit:
+            # Invoice/check/PO number matches are exact: no filters, vector search or reranking
+            limit = self.k
+            docs = [index.docs[doc_id] for doc_id in exact[:limit] if doc_id in index.docs]
+        else:
+            filters = extract_filters(query, index.vendor_names(), self.filter_llm) if self.use_filters else {}
+            limit = max(self.k, self.rerank_fetch_k) if self.rerank else self.k
+            docs = self._search(index, query, exact, filters, limit) if filters else []
+            if filters and not docs:
+                print(f"[INFO] No documents match filters {filters}; searching without them")
+            docs = docs or self._search(index, query, exact, {}, limit)
+
+        start = time.perf_counter()
+        context = rerank_documents(query, docs, self.k) if limit > self.k else docs
+        rerank_s = time.perf_counter() - start
+        if self.assemble:
+            context = assemble_context(context, index.docs, self.token_budget)
+        elif self.drop_empty:
+            context = [Document(page_content=drop_empty_fields(doc.page_content), metadata=doc.metadata)
+                       for doc in context]
+        parents = {doc.metadata.get("parent_id"): index.docs[doc.metadata["parent_id"]].metadata
+                   for doc in docs if doc.metadata.get("parent_id") in index.docs}
+        get_context_stats().record(baseline_pages(docs, parents), context, rerank_s)
+        return context
+
+    def _search(self, index, query, exact, filters, limit):
+        """Fuse the vendor-name matches `exact` (from index.lookup) with BM25 and vector hits."""
+        rankings = [exact, index.bm25(query, self.fetch_k if not filters else len(index.docs))]
+        if filters:
+            rankings = [[i for i in ranking if matches(index.docs[i].metadata, filters)][:self.fetch_k]
+                        for ranking in rankings]
+        if index.docs:
+            where = to_chroma_where(filters, index.document_types())
+            found = self.vectorstore.similarity_search(query, k=min(self.fetch_k, len(index.docs)), filter=where)
+            rankings.append([doc.metadata.get("id") for doc in found])
+        ids = reciprocal_rank_fusion(rankings)[:limit]
+        return [index.docs[doc_id] for doc_id in ids if doc_id in index.docs]
+
+
+class RerankCompressor(BaseDocumentCompressor):
+    """
+    Post-processing for plain vector-store retrievers (wrap them in a
+    ContextualCompressionRetriever that over-fetches): rerank down to `top_n`, then drop
+    empty fields from the pages. `vectorstore` is only read for the parent pages of line
+    item chunks, to measure the tokens saved.
+    """
+    top_n: int = 4
+    drop_empty: bool = CONTEXT_DROP_EMPTY_FIELDS
+    vectorstore: Any = None
+
+    def compress_documents(self, documents: Sequence[Document], query: str,
+                           callbacks: Optional[object] = None) -> Sequence[Document]:
+        start = time.perf_counter()
+        ranked = rerank_documents(query, list(documents), self.top_n)
+        rerank_s = time.perf_counter() - start
+        if self.drop_empty:
+            ranked = [Document(page_content=drop_empty_fields(doc.page_content), metadata=doc.metadata)
+                      for doc in ranked]
+        get_context_stats().record(baseline_pages(documents, self._parents(documents)), ranked, rerank_s)
+        return ranked
+
+    def _parents(self, documents):
+        parents = {doc.metadata.get("id"): doc.metadata for doc in documents if doc.metadata.get("chunk") != "item"}
+        missing = list({doc.metadata["parent_id"] for doc in documents
+                        if doc.metadata.get("parent_id") and doc.metadata["parent_id"] not in parents})
+        if missing and self.vectorstore is not None:
+            found = self.vectorstore.get(ids=missing, include=["metadatas"])
+            parents.update(zip(found["ids"], found["metadatas"]))
+        return parents
+
+
+if __name__ == "__main__":
+    # python -m modules.rag_store [warmup | backfill]
+    #   warmup:   download/load the embedding model ahead of the first user
+    #   backfill: add the numeric date/total metadata to documents stored before it existed
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        print(f"Updated {backfill_numeric_metadata(init_vectorstore())} documents.")
+    else:
+        print(warm_up())
@@ -0,0 +1,119 @@
+# modules/reranker.py
+
+import threading
+from collections import deque
+from config import RERANKER, RERANK_MODEL
+from modules.bm25 import BM25
+from modules.rag_context import estimate_tokens
+from modules.telemetry import percentile
+
+LATENCY_SAMPLES = 512  # Answer latencies kept for the percentiles
+
+
+class LexicalReranker:
+    """BM25 over the candidate set itself; no model, microseconds per candidate."""
+
+    name = "lexical"
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query, texts):
+        index = BM25(self.k1, self.b)
+        for i, text in enumerate(texts):
+            index.add(i, text)
+        scores = index.scores(query)
+        return [scores.get(i, 0.0) for i in range(len(texts))]
+
+
+class CrossEncoderReranker:
+    """Small sentence-transformers cross-encoder scoring (question, passage) pairs on the CPU."""
+
+    name = "cross-encoder"
+
+    def __init__(self, model_name=RERANK_MODEL, max_length=256):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+    def score(self, query, texts):
+        return [float(s) for s in self.model.predict([(query, text) for text in texts], batch_size=32)]
+
+
+def load_reranker(kind=RERANKER):
+    """The configured reranker; falls back to the lexical one when the cross-encoder cannot be loaded."""
+    if kind == "cross-encoder":
+        try:
+            return CrossEncoderReranker()
+        except Exception as e:
+            print(f"[WARN] Cross-encoder reranker unavailable ({e}); using lexical reranking")
+    return LexicalReranker()
+
+
+def rerank_documents(query, docs, k, reranker=None):
+    """The `k` best of `docs` for `query`, best first (ties keep the retrieval order)."""
+    if len(docs) <= 1:
+        return list(docs[:k])
+    scores = (reranker or get_reranker()).score(query, [doc.page_content for doc in docs])
+    order = sorted(range(len(docs)), key=lambda i: -scores[i])
+    return [docs[i] for i in order[:k]]
+
+
+class ContextStats:
+    """
+    What the retrieval post-processing saves: estimated tokens of the baseline context
+    (the top-k whole pages the LLM used to get) vs. the context it gets now, time spent
+    reranking, and the end-to-end latency of rag_query answers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._answers = deque(maxlen=LATENCY_SAMPLES)
+        self.counters = {"queries": 0, "tokens_before": 0, "tokens_after": 0, "rerank_s": 0.0}
+
+    def record(self, baseline_docs, context_docs, rerank_s):
+        before = estimate_tokens("\n\n".join(doc.page_content for doc in baseline_docs))
+        after = estimate_tokens("\n\n".join(doc.page_content for doc in context_docs))
+        with self._lock:
+            self.counters["queries"] += 1
+            self.counters["tokens_before"] += before
+            self.counters["tokens_after"] += after
+            self.counters["rerank_s"] += rerank_s
+
+    def record_answer(self, seconds):
+        with self._lock:
+            self._answers.append(seconds)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            answers = list(self._answers)
+        n = stats["queries"]
+        stats["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+        stats["saved_rate"] = round(stats["tokens_saved"] / stats["tokens_before"], 3) if stats["tokens_before"] else 0.0
+        stats["avg_rerank_ms"] = round(stats.pop("rerank_s") * 1000 / n, 1) if n else 0.0
+        stats["answer_s"] = {
+            "n": len(answers),
+            "p50": round(percentile(answers, 50) or 0.0, 2),
+            "p95": round(percentile(answers, 95) or 0.0, 2),
+        }
+        return stats
+
+
+_reranker = None
+_context_stats = ContextStats()
+_lock = threading.Lock()
+
+
+def get_reranker():
+    """Return the process-wide reranker (the cross-encoder is loaded on first use)."""
+    global _reranker
+    if _reranker is None:
+        with _lock:
+            if _reranker is None:
+                _reranker = load_reranker()
+    return _reranker
+
+
+def get_context_stats():
+    return _context_stats
@@ -0,0 +1,264 @@
+# modules/scheduler.py
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from config import (
+    SCHED_ENABLED, SCHED_MIN_CONCURRENCY, SCHED_MAX_CONCURRENCY, SCHED_INITIAL_CONCURRENCY,
+    SCHED_LATENCY_TOLERANCE, SCHED_BACKOFF, SCHED_INTERACTIVE_RESERVE, SCHED_QUEUE_LIMITS
+)
+from modules.telemetry import percentile
+
+# Priority classes, most urgent first
+PRIORITIES = ("interactive", "batch")
+WAIT_SAMPLES = 512  # Wait times kept per class for the percentiles
+
+_priority = contextvars.ContextVar("model_call_priority", default=None)
+
+
+class QueueFullError(RuntimeError):
+    """Raised when an interactive request finds its queue full; retry later."""
+
+
+@contextmanager
+def priority_scope(priority):
+    """Run the model calls made inside the block (e.g. OCR of a user upload) with `priority`."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority(default="batch"):
+    return _priority.get() or default
+
+
+def with_current_priority(fn):
+    """Wrap `fn` to run with the caller's priority, e.g. on a pool thread (pools do not copy contextvars)."""
+    priority = current_priority()
+
+    def run(*args, **kwargs):
+        with priority_scope(priority):
+            return fn(*args, **kwargs)
+    return run
+
+
+class Ticket:
+    __slots__ = ("priority", "key", "enqueued", "wait_s", "granted", "abandoned")
+
+    def __init__(self, priority, key):
+        self.priority = priority
+        self.key = key
+        self.enqueued = time.perf_counter()
+        self.wait_s = 0.0
+        self.granted = False
+        self.abandoned = False  # The caller stopped waiting (cancelled async task)
+
+
+class AdaptiveScheduler:
+    """
+    Priority admission control in front of the Ollama calls.
+
+    At most `limit` calls run at once; waiting calls are admitted interactive-first, and
+    `interactive_reserve` slots are kept free of batch work so a question never waits for a
+    whole OCR burst. The limit follows AIMD on latency: it grows by 1/limit per call that
+    finishes within `tolerance` x the best latency seen for its model, and shrinks by
+    `backoff` (at most once per baseline interval) on slower calls or errors. A full
+    interactive queue rejects with QueueFullError; a full batch queue blocks the producer
+    until there is room (backpressure).
+    """
+
+    def __init__(self, min_limit=SCHED_MIN_CONCURRENCY, max_limit=SCHED_MAX_CONCURRENCY,
+                 initial=SCHED_INITIAL_CONCURRENCY, tolerance=SCHED_LATENCY_TOLERANCE, backoff=SCHED_BACKOFF,
+                 interactive_reserve=SCHED_INTERACTIVE_RESERVE, queue_limits=SCHED_QUEUE_LIMITS):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial)
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.interactive_reserve = interactive_reserve
+        self.queue_limits = dict(queue_limits)
+        self._cond = threading.Condition()
+        self._heap = []                  # (priority rank, sequence, ticket)
+        self._seq = itertools.count()
+        self._running = 0
+        self._queued = {p: 0 for p in PRIORITIES}
+        self._baseline = {}              # key -> best recent latency (s)
+        self._last_decrease = 0.0
+        self._waits = {p: deque(maxlen=WAIT_SAMPLES) for p in PRIORITIES}
+        self.counters = {"admitted": 0, "rejected": 0, "deferred": 0, "increases": 0, "decreases": 0,
+                         "max_queue_depth": 0}
+
+    def _capacity(self, priority):
+        limit = max(self.min_limit, int(self.limit))
+        if priority != PRIORITIES[0]:
+            limit = max(1, limit - self.interactive_reserve)
+        return limit
+
+    def _admissible(self, ticket):
+        # Only the head of the queue may start, and only while its class has capacity
+        return self._heap[0][2] is ticket and self._running < self._capacity(ticket.priority)
+
+    def acquire(self, priority="batch", key=None, ticket=None):
+        """
+        Wait for admission and return the granted ticket. A `ticket` passed in can be
+        given up from another thread with `abandon`; it is then returned ungranted.
+        """
+        ticket = ticket or Ticket(priority, key)
+        with self._cond:
+            while self._queued[priority] >= self.queue_limits.get(priority, 1 << 30) and not ticket.abandoned:
+                if priority == PRIORITIES[0]:
+                    self.counters["rejected"] += 1
+                    raise QueueFullError(f"{priority} queue is full ({self._queued[priority]} waiting)")
+                self.counters["deferred"] += 1
+                self._cond.wait()
+            if ticket.abandoned:
+                return ticket
+            entry = (PRIORITIES.index(priority), next(self._seq), ticket)
+            self._queued[priority] += 1
+            heapq.heappush(self._heap, entry)
+            self.counters["max_queue_depth"] = max(self.counters["max_queue_depth"], len(self._heap))
+            while not ticket.abandoned and not self._admissible(ticket):
+                self._cond.wait()
+            if ticket.abandoned:
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                self._queued[priority] -= 1
+                self._cond.notify_all()
+                return ticket
+            heapq.heappop(self._heap)
+            self._queued[priority] -= 1
+            self._running += 1
+            ticket.granted = True
+            ticket.wait_s = time.perf_counter() - ticket.enqueued
+            self._waits[priority].append(ticket.wait_s)
+            self.counters["admitted"] += 1
+            self._cond.notify_all()
+        return ticket
+
+    def abandon(self, ticket):
+        """Give up a ticket whose caller went away: leave the queue, or free the slot if it was already granted."""
+        with self._cond:
+            ticket.abandoned = True
+            if ticket.granted:
+                self._running -= 1
+            self._cond.notify_all()
+
+    def release(self, ticket, latency_s, ok=True):
+        with self._cond:
+            self._running -= 1
+            self._adjust(ticket.key, latency_s, ok)
+            self._cond.notify_all()
+
+    def _adjust(self, key, latency_s, ok):
+        base = self._baseline.get(key)
+        if ok:
+            # Best latency seen, drifting up slowly so a permanently slower model does not pin the limit
+            base = latency_s if base is None or latency_s < base else base * 0.98 + latency_s * 0.02
+            self._baseline[key] = base
+        congested = not ok or (base is not None and latency_s > base * self.tolerance)
+        now = time.perf_counter()
+        if congested:
+            if now - self._last_decrease >= (base or 0.0):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                self.counters["decreases"] += 1
+        elif self._running + 1 >= int(self.limit) and self.limit < self.max_limit:
+            # Only grow while the limit is actually the bottleneck
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.counters["increases"] += 1
+
+    @contextmanager
+    def slot(self, priority=None, key=None):
+        """`with scheduler.slot("interactive", model) as ticket:` - wait for admission, then run the call."""
+        ticket = self.acquire(priority or current_priority(), key)
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield ticket
+            ok = True
+        except GeneratorExit:
+            ok = True  # Streams closed early by the caller
+            raise
+        finally:
+            self.release(ticket, time.perf_counter() - start, ok)
+
+    @asynccontextmanager
+    async def aslot(self, priority=None, key=None):
+        """Async `slot`; waiting happens on a worker thread so the event loop keeps running."""
+        priority = priority or current_priority()
+        ticket = Ticket(priority, key)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.acquire, priority, key, ticket)
+        except asyncio.CancelledError:
+            # The worker thread may still be waiting, or already holds the slot: give it back
+            self.abandon(ticket)
+            raise
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield ticket
+            ok = True
+        finally:
+            self.release(ticket, time.perf_counter() - start, ok)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats.update(limit=round(self.limit, 2), running=self._running, queued=dict(self._queued))
+            waits = {p: list(w) for p, w in self._waits.items()}
+        stats["wait_s"] = {
+            p: {"n": len(w), "p50": round(percentile(w, 50) or 0.0, 3), "p95": round(percentile(w, 95) or 0.0, 3)}
+            for p, w in waits.items()
+        }
+        return stats
+
+
+class _NoScheduler:
+    """Stand-in used when SCHED_ENABLED is False: admits everything immediately."""
+
+    @contextmanager
+    def slot(self, priority=None, key=None):
+        yield Ticket(priority or current_priority(), key)
+
+    @asynccontextmanager
+    async def aslot(self, priority=None, key=None):
+        yield Ticket(priority or current_priority(), key)
+
+    def stats(self):
+        return {}
+
+
+_scheduler = None
+_scheduler_options = {}
+_scheduler_lock = threading.Lock()
+
+
+def configure_scheduler(**options):
+    """
+    Set AdaptiveScheduler options for this process, e.g. its share of the concurrency
+    budget (`max_limit`). The scheduler only orders calls within one process, so the app
+    and a bulk_ingest.py run each get their own share. Only applies before the first
+    model call creates the scheduler; later calls are ignored.
+    """
+    if "max_limit" in options:
+        options.setdefault("initial", min(SCHED_INITIAL_CONCURRENCY, options["max_limit"]))
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler_options.update(options)
+
+
+def get_scheduler():
+    """Return the process-wide scheduler shared by the LLM and OCR calls."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = AdaptiveScheduler(**_scheduler_options) if SCHED_ENABLED else _NoScheduler()
+    return _scheduler
@@ -0,0 +1,94 @@
+# modules/singleflight.py
+
+import threading
+from collections import Counter
+
+# Per-key totals are kept for at most this many keys (the busiest survive pruning)
+MAX_TRACKED_KEYS = 1000
+
+
+def _short(key):
+    """Compact label for a (possibly tuple) key of hashes, used in stats."""
+    if isinstance(key, tuple):
+        return "/".join(str(part)[:12] for part in key)
+    return str(key)[:12]
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the function,
+    callers arriving while it is in flight wait for it and get the same result (or
+    exception). Nothing is remembered once the call finishes - that is the caches' job.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._coalesced_by_key = Counter()
+        self.counters = {"executed": 0, "coalesced": 0, "max_waiters": 0}
+
+    def do(self, key, fn):
+        """Run `fn()` once per in-flight `key`. Returns (result, shared), shared being True for waiters."""
+        leader = False
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.counters["coalesced"] += 1
+                self.counters["max_waiters"] = max(self.counters["max_waiters"], call.waiters)
+                self._coalesced_by_key[key] += 1
+                if len(self._coalesced_by_key) > MAX_TRACKED_KEYS:
+                    self._coalesced_by_key = Counter(dict(self._coalesced_by_key.most_common(MAX_TRACKED_KEYS // 2)))
+            else:
+                call = self._calls[key] = _Call()
+                self.counters["executed"] += 1
+                leader = True
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        """Counters plus the current waiters per in-flight key and the most coalesced keys."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = {_short(key): call.waiters for key, call in self._calls.items()}
+            stats["top_keys"] = [(_short(key), n) for key, n in self._coalesced_by_key.most_common(5)]
+        total = stats["executed"] + stats["coalesced"]
+        stats["coalesced_rate"] = round(stats["coalesced"] / total, 3) if total else 0.0
+        return stats
+
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def get_single_flight(name):
+    """Return the process-wide coalescing group `name` ("llm", "ocr", ...)."""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
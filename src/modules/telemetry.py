@@ -0,0 +1,117 @@
+# modules/telemetry.py
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from config import (
+    OLLAMA_METRICS_ENABLED, OLLAMA_METRICS_PATH, OLLAMA_METRICS_MAX_BYTES, OLLAMA_COLD_LOAD_S
+)
+
+_lock = threading.Lock()
+NS = 1e9  # Ollama reports durations in nanoseconds
+
+
+def record_call(site, model, data, wall_s, path=OLLAMA_METRICS_PATH, **extra):
+    """
+    Append one metrics record for an Ollama call.
+
+    `site` tags the caller ("ocr", "rag", "agent", "tool", ...), `data` is the final
+    Ollama response object (or the last streamed chunk) carrying the timing fields and
+    `wall_s` is the client-side latency. Extra keyword arguments are stored as-is.
+    """
+    if not OLLAMA_METRICS_ENABLED:
+        return None
+    data = data or {}
+    eval_s = data.get("eval_duration", 0) / NS
+    load_s = data.get("load_duration", 0) / NS
+    entry = {
+        "ts": round(time.time(), 3),
+        "site": site,
+        "model": model,
+        "wall_s": round(wall_s, 4),
+        "total_s": round(data.get("total_duration", 0) / NS, 4),
+        "load_s": round(load_s, 4),
+        "prompt_tokens": data.get("prompt_eval_count", 0),
+        "prompt_eval_s": round(data.get("prompt_eval_duration", 0) / NS, 4),
+        "eval_tokens": data.get("eval_count", 0),
+        "eval_s": round(eval_s, 4),
+        "tokens_per_s": round(data.get("eval_count", 0) / eval_s, 2) if eval_s else None,
+        "cold_load": load_s > OLLAMA_COLD_LOAD_S,
+        **{k: round(v, 4) if isinstance(v, float) else v for k, v in extra.items()},
+    }
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    with _lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) + len(line) > OLLAMA_METRICS_MAX_BYTES:
+            os.replace(path, path + ".1")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+    return entry
+
+
+def load_records(path=OLLAMA_METRICS_PATH):
+    records = []
+    for p in (path + ".1", path):
+        if os.path.exists(p):
+            with open(p, encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(records, by=("model", "site")):
+    """Per-group call counts, latency percentiles, generation speed and cold-load frequency."""
+    groups = defaultdict(list)
+    for r in records:
+        groups[tuple(r.get(k) for k in by)].append(r)
+
+    summary = []
+    for key, rows in sorted(groups.items(), key=lambda item: str(item[0])):
+        walls = [r["wall_s"] for r in rows]
+        eval_tokens = sum(r["eval_tokens"] for r in rows)
+        # Streams cut before Ollama's final chunk carry no timings: leave them out of the rates
+        complete = [r for r in rows if not r.get("truncated")]
+        eval_s = sum(r["eval_s"] for r in complete)
+        cold = sum(1 for r in complete if r["cold_load"])
+        summary.append({
+            **dict(zip(by, key)),
+            "calls": len(rows),
+            "p50_s": percentile(walls, 50),
+            "p95_s": percentile(walls, 95),
+            "p99_s": percentile(walls, 99),
+            "tokens_per_s": round(sum(r["eval_tokens"] for r in complete) / eval_s, 1) if eval_s else None,
+            "avg_prompt_tokens": round(sum(r["prompt_tokens"] for r in complete) / len(complete), 1) if complete else None,
+            "avg_eval_tokens": round(eval_tokens / len(rows), 1),
+            "cold_loads": cold,
+            "cold_load_rate": round(cold / len(complete), 3) if complete else None,
+        })
+    return summary
+
+
+def print_summary(summary):
+    if not summary:
+        print("No metrics recorded yet.")
+        return
+    print(f"{'model':<16} {'site':<8} {'calls':>6} {'p50_s':>7} {'p95_s':>7} {'p99_s':>7} "
+          f"{'tok/s':>7} {'prompt':>7} {'gen':>6} {'cold':>6}")
+    for row in summary:
+        print(f"{str(row['model']):<16} {str(row['site']):<8} {row['calls']:>6} "
+              f"{row['p50_s']:>7.2f} {row['p95_s']:>7.2f} {row['p99_s']:>7.2f} "
+              f"{row['tokens_per_s'] or 0:>7.1f} {row['avg_prompt_tokens'] or 0:>7.0f} "
+              f"{row['avg_eval_tokens']:>6.0f} {row['cold_load_rate'] or 0:>6.0%}")
+
+
+if __name__ == "__main__":
+    # python -m modules.telemetry [metrics.jsonl]
+    import sys
+
+    print_summary(summarize(load_records(sys.argv[1] if len(sys.argv) > 1 else OLLAMA_METRICS_PATH)))
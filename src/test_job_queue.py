@@ -0,0 +1,44 @@
+# test_job_queue.py
+# python test_job_queue.py   (runs against the local fake Ollama server, no GPU needed)
+
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+from config import OLLAMA_BASE_URL
+from modules import doc_logger
+from modules.fake_ollama import FakeOllama
+from modules.job_queue import JobQueue, DONE
+from modules.ollama_client import register_router
+from modules.rag_store import init_vectorstore
+
+OUTAGE_S = 2.0  # The fake server answers every call with HTTP 500 for this long
+
+
+def test_jobs_survive_ollama_outage():
+    tmp = tempfile.mkdtemp()
+    doc_logger.LOG_FILE = Path(tmp) / "parsed_docs.jsonl"
+    paths = []
+    for i in range(4):
+        path = os.path.join(tmp, f"receipt-{i}.png")
+        Image.new("RGB", (400, 600), (i, 0, 0)).save(path)
+        paths.append(path)
+
+    with FakeOllama(error_rate=1.0) as fake:
+        register_router(OLLAMA_BASE_URL, [fake.base_url])
+        threading.Timer(OUTAGE_S, setattr, (fake, "error_rate", 0.0)).start()
+        # Backoffs of 1 s and 2 s: the third attempt falls after the outage
+        queue = JobQueue(path=os.path.join(tmp, "jobs.db"), max_attempts=3, retry_backoff=1.0)
+        job_ids = [queue.enqueue(path) for path in paths]
+        status = queue.run(init_vectorstore(os.path.join(tmp, "chroma")), workers=2, use_cache=False)
+
+    assert status["jobs"] == {DONE: len(paths)}, status
+    assert all(queue.get(job_id)["attempts"] > 1 for job_id in job_ids)
+
+
+if __name__ == "__main__":
+    test_jobs_survive_ollama_outage()
+    print("Jobs completed after the outage ✅")
@@ -0,0 +1,28 @@
+# test_query_filters.py
+# python test_query_filters.py   (pure rules, no Ollama or vector store needed)
+
+from modules.query_filters import rule_filters
+
+
+def test_counts_are_not_amounts():
+    assert "min_total" not in rule_filters("vendors we bought from more than 3 times")
+    assert "max_total" not in rule_filters("items ordered less than 10 times")
+    assert rule_filters("invoices over $500")["min_total"] == 500.0
+    assert rule_filters("receipts with a total under 50")["max_total"] == 50.0
+    assert rule_filters("spent more than 200 euros")["min_total"] == 200.0
+
+
+def test_several_dates_give_no_date_filter():
+    assert "date_from" not in rule_filters("invoices from March 2023 or May 2023")
+    assert "date_from" not in rule_filters("invoices in 2022 and 2023")
+    filters = rule_filters("invoices from March 2023")
+    assert (filters["date_from"], filters["date_to"]) == (20230301, 20230331)
+    filters = rule_filters("totals between $1000 and 2000 in 2023")
+    assert (filters["date_from"], filters["date_to"]) == (20230101, 20231231)
+    assert (filters["min_total"], filters["max_total"]) == (1000.0, 2000.0)
+
+
+if __name__ == "__main__":
+    test_counts_are_not_amounts()
+    test_several_dates_give_no_date_filter()
+    print("Query filter rules ✅")